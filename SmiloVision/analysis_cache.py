@@ -0,0 +1,161 @@
+"""
+Content-addressed cache for teeth analysis results
+Keyed by decoded pixels, analyzer configuration and algorithm version
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class AnalysisCache:
+    def __init__(self, max_bytes=256 * 1024 * 1024, disk_dir=None):
+        """
+        Args:
+            max_bytes: Memory bound for the in-process LRU tier
+            disk_dir: Optional directory for a tier shared by worker processes
+        """
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self._init_memory_tier()
+
+    def _init_memory_tier(self):
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def __getstate__(self):
+        # Memory tier and lock stay in this process; the disk tier is shared
+        return {'max_bytes': self.max_bytes, 'disk_dir': self.disk_dir}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_memory_tier()
+
+    @staticmethod
+    def make_key(img_array, config, version):
+        """Hash the decoded pixels together with what determines the result"""
+        pixels = np.ascontiguousarray(img_array)
+        digest = hashlib.blake2b(digest_size=20)
+        header = {
+            'shape': pixels.shape,
+            'dtype': pixels.dtype.str,
+            'config': config,
+            'version': version,
+        }
+        digest.update(json.dumps(header, sort_keys=True, default=str).encode())
+        digest.update(memoryview(pixels).cast('B'))
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Return the cached result for key, or None on a miss"""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+
+        value = self._read_disk(key)
+
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._store(key, value)
+        return value
+
+    def put(self, key, value):
+        """Store a result in memory and, if configured, on disk"""
+        with self._lock:
+            self._store(key, value)
+        self._write_disk(key, value)
+
+    def clear(self):
+        """Drop the memory tier (the disk tier is left for other processes)"""
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        """Hit and miss counters plus memory tier usage"""
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+            }
+
+    def _store(self, key, value):
+        """Insert into the LRU tier and evict down to the memory bound"""
+        size = self.estimate_size(value)
+        if size > self.max_bytes:
+            return
+
+        if key in self._entries:
+            self.current_bytes -= self._sizes[key]
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        self._sizes[key] = size
+        self.current_bytes += size
+
+        while self.current_bytes > self.max_bytes:
+            old_key, _ = self._entries.popitem(last=False)
+            self.current_bytes -= self._sizes.pop(old_key)
+
+    @staticmethod
+    def estimate_size(value):
+        """Approximate memory held by a cached result"""
+        if isinstance(value, np.ndarray):
+            return value.nbytes
+        if isinstance(value, dict):
+            return 64 + sum(AnalysisCache.estimate_size(v) for v in value.values())
+        if hasattr(value, 'nbytes'):
+            return value.nbytes
+        return 64
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key[:2], key + '.pkl')
+
+    def _read_disk(self, key):
+        if not self.disk_dir:
+            return None
+        try:
+            with open(self._disk_path(key), 'rb') as f:
+                return pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+
+    def _write_disk(self, key, value):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temp file and rename so readers never see partial entries
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except OSError:
+            # The disk tier is best effort; the memory tier still holds the result
+            pass
@@ -0,0 +1,133 @@
+"""
+Compact container for teeth analysis results
+Masks are kept run-length encoded and decoded only when accessed
+"""
+
+import uuid
+from collections.abc import Mapping
+from dataclasses import dataclass, field
+
+import numpy as np
+
+
+def rle_encode(mask):
+    """
+    Run-length encode a binary mask in row-major order
+
+    Returns:
+        tuple of (runs as uint32 array, whether the first run is foreground)
+    """
+    flat = np.ascontiguousarray(mask).reshape(-1) > 0
+    if flat.size == 0:
+        return np.empty(0, dtype=np.uint32), False
+
+    boundaries = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    edges = np.concatenate(([0], boundaries, [flat.size]))
+    return np.diff(edges).astype(np.uint32), bool(flat[0])
+
+
+def rle_decode(runs, first_value, shape):
+    """Rebuild a 0/255 uint8 mask from rle_encode output"""
+    values = np.zeros(len(runs), dtype=np.uint8)
+    values[0 if first_value else 1::2] = 255
+    return np.repeat(values, runs).reshape(shape)
+
+
+@dataclass(frozen=True, slots=True, eq=False)
+class RunLengthMask:
+    """Binary mask stored as row-major run lengths"""
+
+    shape: tuple
+    runs: np.ndarray
+    first_value: bool
+
+    @classmethod
+    def encode(cls, mask):
+        runs, first_value = rle_encode(mask)
+        return cls(tuple(mask.shape), runs, first_value)
+
+    def decode(self):
+        """Rebuild the 0/255 uint8 mask"""
+        return rle_decode(self.runs, self.first_value, self.shape)
+
+    @property
+    def nbytes(self):
+        return self.runs.nbytes
+
+
+@dataclass(frozen=True, slots=True, eq=False)
+class AnalysisResult(Mapping):
+    """
+    Result of TeethAnalyzer.analyze_teeth
+
+    Supports the same key access as the plain dict it replaces, e.g.
+    results['overall_score'] and results['teeth_mask'].
+    """
+
+    overall_score: float
+    yellowness_score: float
+    yellowness_severity: dict
+    cavity_score: float
+    cavity_severity: dict
+    alignment_score: float
+    alignment_severity: dict
+    encoded_teeth_mask: RunLengthMask
+    encoded_stain_mask: RunLengthMask
+    cavity_candidates: np.ndarray
+    alignment_contour: np.ndarray = None
+    # (x, y) factors from the analyzed image to the working resolution
+    working_scale: tuple = (1.0, 1.0)
+    processed_image: np.ndarray = None
+    # Identifies this analysis for caches keyed by scan
+    scan_key: str = field(default_factory=lambda: uuid.uuid4().hex)
+
+    _KEYS = (
+        'overall_score', 'yellowness_score', 'yellowness_severity',
+        'cavity_score', 'cavity_severity', 'alignment_score',
+        'alignment_severity', 'teeth_mask', 'stain_mask',
+        'cavity_candidates', 'alignment_contour', 'working_scale',
+        'processed_image', 'scan_key',
+    )
+
+    @classmethod
+    def from_arrays(cls, teeth_mask, stain_mask, **fields):
+        """Build a result, encoding full-resolution 0/255 masks"""
+        return cls(encoded_teeth_mask=RunLengthMask.encode(teeth_mask),
+                   encoded_stain_mask=RunLengthMask.encode(stain_mask), **fields)
+
+    @property
+    def image_shape(self):
+        """Height and width of the analyzed image"""
+        return self.encoded_teeth_mask.shape[:2]
+
+    @property
+    def teeth_mask(self):
+        """Decoded 0/255 uint8 teeth mask at original image resolution"""
+        return self.encoded_teeth_mask.decode()
+
+    @property
+    def stain_mask(self):
+        """Decoded 0/255 uint8 mask of stained teeth pixels at original resolution"""
+        return self.encoded_stain_mask.decode()
+
+    @property
+    def nbytes(self):
+        """Approximate memory held by this result"""
+        size = 256 + self.encoded_teeth_mask.nbytes + self.encoded_stain_mask.nbytes
+        size += self.cavity_candidates.nbytes
+        if self.alignment_contour is not None:
+            size += self.alignment_contour.nbytes
+        if self.processed_image is not None:
+            size += self.processed_image.nbytes
+        return size
+
+    def __getitem__(self, key):
+        if key not in self._KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self):
+        return iter(self._KEYS)
+
+    def __len__(self):
+        return len(self._KEYS)
@@ -1,27 +1,32 @@
 import streamlit as st
-import cv2
 import numpy as np
 from PIL import Image
-import matplotlib.pyplot as plt
-import plotly.express as px
-import plotly.graph_objects as go
-from datetime import datetime, timedelta
-import pandas as pd
-import base64
-from io import BytesIO
-import json
-import os
-from image_analyzer import TeethAnalyzer
-from report_generator import ReportGenerator
-from database import Database
-from dental_tips_library import DentalTipsLibrary
-
-# Initialize components
-if 'analyzer' not in st.session_state:
-    st.session_state.analyzer = TeethAnalyzer()
-    st.session_state.report_gen = ReportGenerator()
-    st.session_state.db = Database()
-    st.session_state.tips_library = DentalTipsLibrary()
+from datetime import datetime
+from image_analyzer import ANALYSIS_STAGES
+from overlay_renderer import visible_layers
+from services import (get_analyzer, get_database, get_report_generator,
+                      get_tips_library)
+from warmup import start_warm_up
+
+# Plotting libraries and reportlab are imported inside the screens that use
+# them. serve.py warms them up before the server opens its port; under a
+# plain `streamlit run` the warm-up starts here in the background instead
+start_warm_up()
+
+# Scans per page of history on the progress and compare screens
+PROGRESS_PAGE_SIZE = 100
+COMPARE_PAGE_SIZE = 25
+
+# Progress trend views: (days, rollup granularity); None plots the scans on screen
+TREND_RANGES = {
+    "Scans on this page": (None, None),
+    "Last 30 days (daily)": (30, 'day'),
+    "Last 90 days (daily)": (90, 'day'),
+    "Last year (weekly)": (365, 'week'),
+}
+
+# Analyzer, report generator, database and tips library are process-wide
+# services (see services.py); sessions only hold their own UI state
 
 # Initialize session state
 if 'current_screen' not in st.session_state:
@@ -33,7 +38,7 @@ if 'current_image' not in st.session_state:
 if 'analysis_results' not in st.session_state:
     st.session_state.analysis_results = None
 if 'user_rewards' not in st.session_state:
-    progress = st.session_state.db.get_user_progress()
+    progress = get_database().get_user_progress()
     st.session_state.user_rewards = {'stars': progress['stars'], 'coins': progress['coins']}
 
 def main():
@@ -180,7 +185,7 @@ def show_home_screen():
         
         with col2:
             # Recent stats if available
-            recent_scans = st.session_state.db.get_recent_scans(5)
+            recent_scans = get_database().get_recent_scans(5)
             if recent_scans:
                 st.markdown("**Recent Scans**")
                 for scan in recent_scans:
@@ -230,13 +235,14 @@ def show_camera_screen():
         st.markdown("**Preview:**")
         
         # Display image with oval overlay guide
+        import matplotlib.pyplot as plt
+        from matplotlib.patches import Ellipse
         image = Image.open(st.session_state.current_image)
         fig, ax = plt.subplots(1, 1, figsize=(8, 6))
         ax.imshow(image)
         ax.set_title("Image Preview with Guide")
         
         # Draw oval guide
-        from matplotlib.patches import Ellipse
         height, width = image.height, image.width
         oval = Ellipse((width/2, height/2), width*0.6, height*0.4, 
                       fill=False, color='lime', linewidth=3, linestyle='--')
@@ -267,7 +273,7 @@ def show_quality_check_screen():
         
         # Perform quality checks
         with st.spinner("Checking image quality..."):
-            quality_results = st.session_state.analyzer.check_image_quality(img_array)
+            quality_results = get_analyzer().check_image_quality(img_array)
         
         # Display results
         col1, col2, col3 = st.columns(3)
@@ -336,26 +342,25 @@ def show_analysis_screen():
         image = Image.open(st.session_state.current_image)
         img_array = np.array(image)
         
-        # Analysis steps
-        steps = [
-            ("Preprocessing image...", 0.2),
-            ("Detecting teeth region...", 0.4),
-            ("Analyzing staining...", 0.6),
-            ("Checking for dark spots...", 0.8),
-            ("Evaluating alignment...", 1.0)
-        ]
+        # Progress follows the analyzer's stage events
+        stage_text = {
+            'preprocess': "Preprocessing image...",
+            'segment': "Detecting teeth region...",
+            'yellowness': "Analyzing staining...",
+            'cavities': "Checking for dark spots...",
+            'alignment': "Evaluating alignment...",
+            'scoring': "Finalizing analysis...",
+        }
         
-        for step_text, progress in steps:
-            status_text.text(step_text)
-            progress_bar.progress(progress)
-            
-            # Simulate processing time
-            import time
-            time.sleep(0.5)
+        def on_progress(stage, status):
+            if stage == 'cached':
+                progress_bar.progress(1.0)
+            elif status == 'start':
+                status_text.text(stage_text[stage])
+            else:
+                progress_bar.progress((ANALYSIS_STAGES.index(stage) + 1) / len(ANALYSIS_STAGES))
         
-        # Perform actual analysis
-        with st.spinner("Finalizing analysis..."):
-            results = st.session_state.analyzer.analyze_teeth(img_array)
+        results = get_analyzer().analyze_teeth(img_array, progress_callback=on_progress)
         
         st.session_state.analysis_results = results
         
@@ -366,8 +371,6 @@ def show_analysis_screen():
             st.success("✅ Analysis completed successfully")
         
         # Auto-redirect to results
-        import time
-        time.sleep(1)
         st.session_state.current_screen = 'results'
         st.rerun()
 
@@ -378,15 +381,20 @@ def show_results_screen():
 
     results = st.session_state.analysis_results
     
+    # Save results and award rewards once per analysis, not on every rerun
+    if st.session_state.get('saved_scan_key') != results['scan_key']:
+        record_scan(results)
+    
     if st.session_state.kid_mode:
         show_kid_results(results)
     else:
         show_adult_results(results)
+
+def record_scan(results):
+    """Store a finished scan with its rewards and refresh the rewards shown"""
     
-    # Save results to database and update rewards
-    st.session_state.db.save_scan_results(results)
-    
-    # Update rewards in database
+    # Kid mode awards stars and coins by score
+    stars_earned = coins_earned = 0
     if st.session_state.kid_mode:
         overall_score = results['overall_score']
         if overall_score >= 80:
@@ -398,8 +406,11 @@ def show_results_screen():
         else:
             stars_earned = 1
             coins_earned = 2
-        
-        st.session_state.db.update_user_rewards(stars_earned, coins_earned)
+    
+    scan_image = np.array(Image.open(st.session_state.current_image)) if st.session_state.current_image else None
+    progress = get_database().record_scan_outcome(results, stars_earned, coins_earned, image=scan_image)
+    st.session_state.saved_scan_key = results['scan_key']
+    st.session_state.user_rewards = {'stars': progress['stars'], 'coins': progress['coins']}
 
 def show_kid_results(results):
     st.markdown("# 🎉 Your Smile Report! 😊✨")
@@ -427,7 +438,7 @@ def show_kid_results(results):
     
     # Show analyzed image
     st.markdown("### 🔍 Your Smile Analysis")
-    analyzed_img = st.session_state.analyzer.create_visual_overlay(
+    analyzed_img = get_analyzer().create_visual_overlay(
         np.array(Image.open(st.session_state.current_image)), results)
     st.image(analyzed_img, caption="Your teeth with colorful markings!", use_container_width=True)
     
@@ -451,6 +462,8 @@ def show_kid_results(results):
             st.rerun()
 
 def show_adult_results(results):
+    import plotly.graph_objects as go
+    
     st.markdown("# 📊 Comprehensive Smile Analysis")
     
     # Overall score
@@ -482,8 +495,22 @@ def show_adult_results(results):
     
     with col1:
         st.markdown("### 🔍 Visual Analysis")
-        analyzed_img = st.session_state.analyzer.create_visual_overlay(
-            np.array(Image.open(st.session_state.current_image)), results)
+        
+        # Layers are cached per scan, so toggling them only re-blends
+        layer_labels = {
+            'staining': "🟡 Staining",
+            'cavities': "🔴 Dark spots",
+            'alignment': "🔵 Alignment",
+        }
+        shown_layers = st.multiselect(
+            "Overlay layers",
+            options=list(layer_labels),
+            default=visible_layers(results),
+            format_func=lambda name: layer_labels[name],
+            key=f"overlay_layers_{results['scan_key']}"
+        )
+        analyzed_img = get_analyzer().create_visual_overlay(
+            np.array(Image.open(st.session_state.current_image)), results, layers=shown_layers)
         st.image(analyzed_img, caption="Detected issues marked with overlays", use_container_width=True)
         
         # Legend
@@ -521,7 +548,7 @@ def show_adult_results(results):
     with col1:
         if st.button("📄 Generate PDF Report", use_container_width=True):
             with st.spinner("Generating PDF report..."):
-                pdf_data = st.session_state.report_gen.generate_pdf_report(
+                pdf_data = get_report_generator().generate_pdf_report(
                     st.session_state.current_image, results)
             st.download_button(
                 label="⬇️ Download PDF",
@@ -541,6 +568,45 @@ def show_adult_results(results):
             st.session_state.analysis_results = None
             st.rerun()
 
+def scan_history_page(key, page_size):
+    """
+    Fetch the page of scan history shown under key, with Older/Newer buttons
+    
+    Returns:
+        page dict from Database.get_scans_page
+    """
+    cursor, direction = st.session_state.get(key, (None, 'older'))
+    page = get_database().get_scans_page(page_size, cursor, direction)
+    if not page['scans'] and cursor is not None:
+        # The page emptied (e.g. history was cleared); go back to the newest
+        del st.session_state[key]
+        page = get_database().get_scans_page(page_size)
+    
+    if page['has_older'] or page['has_newer']:
+        col1, col2 = st.columns(2)
+        with col1:
+            if page['has_older'] and st.button("◀ Older", key=f"{key}_older", use_container_width=True):
+                st.session_state[key] = (page['older_cursor'], 'older')
+                st.rerun()
+        with col2:
+            if page['has_newer'] and st.button("Newer ▶", key=f"{key}_newer", use_container_width=True):
+                st.session_state[key] = (page['newer_cursor'], 'newer')
+                st.rerun()
+    
+    return page
+
+def select_scan(label, key, latest=False):
+    """Selectbox over one page of scan history; returns the chosen scan"""
+    scans = scan_history_page(f'{key}_page', COMPARE_PAGE_SIZE)['scans']
+    scans_by_id = {scan['id']: scan for scan in scans}
+    scan_ids = list(scans_by_id)
+    
+    default_idx = len(scan_ids) - 1 if latest else 0
+    scan_id = st.selectbox(label, scan_ids, index=default_idx,
+                           format_func=lambda x: f"{scans_by_id[x]['date']} (Score: {scans_by_id[x]['overall_score']:.0f})",
+                           key=f"{key}_select")
+    return scans_by_id[scan_id]
+
 def show_progress_screen():
     if st.session_state.kid_mode:
         st.markdown("# 📈 My Progress Journey! ⭐")
@@ -549,16 +615,24 @@ def show_progress_screen():
         st.markdown("# 📈 Progress Tracker")
         st.markdown("### Historical analysis and trends")
 
-    # Get historical data
-    scans = st.session_state.db.get_all_scans()
+    # Get the window of history on screen, plus whole-history figures
+    db = get_database()
+    stats = db.get_stats_summary()
     
-    if not scans:
+    if stats['total_scans'] == 0:
         if st.session_state.kid_mode:
             st.info("🎯 No scans yet! Take your first photo to start your journey! 🚀")
         else:
             st.info("📊 No historical data available. Complete your first scan to track progress.")
         return
     
+    import pandas as pd
+    import plotly.express as px
+    import plotly.graph_objects as go
+    
+    page = scan_history_page('progress_page', PROGRESS_PAGE_SIZE)
+    scans = page['scans']
+    
     # Convert to DataFrame for easier plotting
     df = pd.DataFrame(scans)
     df['date'] = pd.to_datetime(df['date'])
@@ -568,11 +642,11 @@ def show_progress_screen():
         col1, col2 = st.columns(2)
         
         with col1:
-            st.metric("🦷 Total Scans", len(scans))
+            st.metric("🦷 Total Scans", stats['total_scans'])
             st.metric("⭐ Total Stars", st.session_state.user_rewards['stars'])
         
         with col2:
-            latest_score = df['overall_score'].iloc[-1] if len(df) > 0 else 0
+            latest_score = stats['latest_score']
             st.metric("🏆 Latest Score", f"{latest_score:.0f}/100")
             st.metric("🪙 Total Coins", st.session_state.user_rewards['coins'])
         
@@ -593,30 +667,43 @@ def show_progress_screen():
         col1, col2, col3, col4 = st.columns(4)
         
         with col1:
-            st.metric("Total Scans", len(scans))
+            st.metric("Total Scans", stats['total_scans'])
         with col2:
-            avg_score = df['overall_score'].mean()
+            avg_score = stats['avg_overall_score']
             st.metric("Average Score", f"{avg_score:.1f}/100")
         with col3:
-            if len(df) >= 2:
-                improvement = df['overall_score'].iloc[-1] - df['overall_score'].iloc[-2]
+            recent = db.get_recent_scans(2)
+            if len(recent) >= 2:
+                improvement = recent[0]['overall_score'] - recent[1]['overall_score']
                 st.metric("Score Change", f"{improvement:+.1f}", delta=f"{improvement:.1f}")
             else:
                 st.metric("Score Change", "N/A")
         with col4:
-            latest_score = df['overall_score'].iloc[-1] if len(df) > 0 else 0
+            latest_score = stats['latest_score']
             st.metric("Latest Score", f"{latest_score:.1f}/100")
         
         # Detailed charts
         tab1, tab2, tab3 = st.tabs(["📊 Overall Trends", "🔍 Detailed Metrics", "📅 Scan History"])
         
         with tab1:
-            # Overall score trend
-            fig = px.line(df, x='date', y='overall_score', 
-                         title="Overall Health Score Trend",
-                         color_discrete_sequence=['#4A90E2'])
-            fig.update_layout(yaxis_range=[0, 100])
-            st.plotly_chart(fig, use_container_width=True)
+            # Overall score trend, per scan or from daily/weekly rollups
+            trend_range = st.selectbox("Trend range", list(TREND_RANGES), key="trend_range")
+            days, granularity = TREND_RANGES[trend_range]
+            if granularity is None:
+                trend_df = df
+            else:
+                trend_df = pd.DataFrame(db.get_progress_trends(days, granularity),
+                                        columns=['date', 'overall_score'])
+                trend_df['date'] = pd.to_datetime(trend_df['date'])
+            
+            if len(trend_df) > 0:
+                fig = px.line(trend_df, x='date', y='overall_score', 
+                             title="Overall Health Score Trend",
+                             color_discrete_sequence=['#4A90E2'])
+                fig.update_layout(yaxis_range=[0, 100])
+                st.plotly_chart(fig, use_container_width=True)
+            else:
+                st.info("No scans in this period.")
         
         with tab2:
             # Multi-metric chart
@@ -633,7 +720,7 @@ def show_progress_screen():
         with tab3:
             # Scan history table
             st.markdown("**Recent Scan History**")
-            display_scans = scans[-10:] if len(scans) > 10 else scans
+            display_scans = scans[-10:]
             display_scans.reverse()
             
             for scan in display_scans:
@@ -655,40 +742,26 @@ def show_comparison_screen():
     st.markdown("# 🔄 Compare Your Scans")
     st.markdown("### Track your progress by comparing two scans")
     
-    # Get all scans
-    scans = st.session_state.db.get_all_scans()
-    
-    if len(scans) < 2:
+    if get_database().get_stats_summary()['total_scans'] < 2:
         st.info("📊 You need at least 2 scans to compare. Take more scans to track your progress!")
         if st.button("📸 Take a Scan", use_container_width=True):
             st.session_state.current_screen = 'camera'
             st.rerun()
         return
     
-    # Create scan selection dropdowns
+    # Create scan selection dropdowns, each over its own page of history
     col1, col2 = st.columns(2)
     
-    # Prepare scan options with dates and scores
-    scan_options = [f"{scan['date']} (Score: {scan['overall_score']:.0f})" for scan in scans]
-    
     with col1:
         st.markdown("### 📊 First Scan")
-        scan1_idx = st.selectbox("Select first scan", range(len(scans)), 
-                                 format_func=lambda x: scan_options[x],
-                                 key="scan1_select")
-        scan1 = scans[scan1_idx]
+        scan1 = select_scan("Select first scan", 'compare1')
     
     with col2:
         st.markdown("### 📊 Second Scan")
         # Default to latest scan if available
-        default_idx = len(scans) - 1 if scan1_idx != len(scans) - 1 else len(scans) - 2
-        scan2_idx = st.selectbox("Select second scan", range(len(scans)), 
-                                 format_func=lambda x: scan_options[x],
-                                 index=default_idx,
-                                 key="scan2_select")
-        scan2 = scans[scan2_idx]
-    
-    if scan1_idx == scan2_idx:
+        scan2 = select_scan("Select second scan", 'compare2', latest=True)
+    
+    if scan1['id'] == scan2['id']:
         st.warning("⚠️ Please select two different scans to compare")
         return
     
@@ -733,6 +806,7 @@ def show_comparison_screen():
     st.markdown("### 📊 Visual Comparison")
     
     # Create comparison chart
+    import plotly.graph_objects as go
     metrics = ['Overall\nScore', 'Whiteness', 'Dark Spot\nHealth', 'Alignment']
     scan1_values = [
         scan1['overall_score'],
@@ -823,11 +897,11 @@ def show_comparison_screen():
 
 def generate_kid_tips(results):
     """Generate kid-friendly tips using severity-based library"""
-    return st.session_state.tips_library.get_kid_friendly_tips(results)
+    return get_tips_library().get_kid_friendly_tips(results)
 
 def generate_adult_tips(results):
     """Generate adult tips using severity-based comprehensive library"""
-    comprehensive_tips = st.session_state.tips_library.get_comprehensive_tips(results)
+    comprehensive_tips = get_tips_library().get_comprehensive_tips(results)
     
     # Combine priority actions and prevention tips
     tips = []
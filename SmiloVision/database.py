@@ -1,18 +1,149 @@
 import sqlite3
+import ast
 import json
-from datetime import datetime
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 import os
+from itertools import islice
+from scan_artifacts import decode_artifact, split_results
+
+INSERT_SCAN_SQL = """
+    INSERT INTO scans (date, overall_score, yellowness_score, cavity_score, 
+                     alignment_score, analysis_data, created_ts, scan_key)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (scan_key) DO NOTHING
+"""
+
+INSERT_ARTIFACT_SQL = """
+    INSERT INTO scan_artifacts (scan_id, kind, encoding, meta, data)
+    VALUES (?, ?, ?, ?, ?)
+"""
+
+# Latest scan by (created_ts, id), found with the covering index
+LATEST_SCAN_QUERY = """
+    SELECT id, COALESCE(created_ts, 0), overall_score, date
+    FROM scans
+    ORDER BY created_ts DESC, id DESC
+    LIMIT 1
+"""
+
+# Score columns summarized in the trend rollups
+ROLLUP_METRICS = ('overall_score', 'yellowness_score', 'cavity_score', 'alignment_score')
+
+# Rollup table, bucket expression over a scans date column, and bucket
+# length in days for each trend granularity. Buckets come from the local-time
+# date string alone: the calendar day, or the Monday starting the week. Over
+# the bare column the expressions are indexed (migration 8).
+ROLLUPS = {
+    'day': ('scan_rollup_daily', "substr({date}, 1, 10)", 1),
+    'week': ('scan_rollup_weekly', "date({date}, 'weekday 0', '-6 days')", 7),
+}
+
+# Scans have no owner column yet; everything belongs to the single user
+DEFAULT_USER_ID = 1
 
 class Database:
-    def __init__(self, db_path="smilo.db"):
+    def __init__(self, db_path="smilo.db", pool_size=8, busy_timeout=5.0):
+        """
+        Args:
+            db_path: SQLite database file
+            pool_size: Idle connections kept open for reuse
+            busy_timeout: Seconds a writer waits for the write lock
+        """
         self.db_path = db_path
+        self.pool_size = pool_size
+        self.busy_timeout = busy_timeout
+        self._pool = []
+        self._pool_lock = threading.Lock()
+        self._local = threading.local()
+        self._closed = False
         self.init_database()
     
+    def _connect(self):
+        """Open a connection with WAL journaling and tuned pragmas"""
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout,
+                               isolation_level=None, check_same_thread=False)
+        # WAL lets readers run alongside a writer instead of blocking on it
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout * 1000)}")
+        # NORMAL is durable across application crashes in WAL mode
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA cache_size=-8192")
+        conn.execute("PRAGMA mmap_size=67108864")
+        return conn
+    
+    @contextmanager
+    def connection(self):
+        """Borrow a pooled connection; nested uses on one thread share it"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            yield conn
+            return
+        
+        with self._pool_lock:
+            conn = self._pool.pop() if self._pool else None
+        if conn is None:
+            conn = self._connect()
+        
+        self._local.conn = conn
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            if conn.in_transaction:
+                conn.rollback()
+            with self._pool_lock:
+                if not self._closed and len(self._pool) < self.pool_size:
+                    self._pool.append(conn)
+                    conn = None
+            if conn is not None:
+                conn.close()
+    
+    @contextmanager
+    def transaction(self, write=True):
+        """
+        Run statements in one transaction and yield a cursor
+        
+        Writes start with BEGIN IMMEDIATE so the write lock is taken up
+        front rather than failing on upgrade. Nested calls join the
+        enclosing transaction.
+        """
+        with self.connection() as conn:
+            if conn.in_transaction:
+                yield conn.cursor()
+                return
+            
+            conn.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+            try:
+                yield conn.cursor()
+            except BaseException:
+                conn.rollback()
+                raise
+            conn.commit()
+    
+    def close(self):
+        """Close pooled connections; borrowed ones close when returned"""
+        with self._pool_lock:
+            self._closed = True
+            pool, self._pool = self._pool, []
+        for conn in pool:
+            conn.close()
+    
     def init_database(self):
         """Initialize database with required tables"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self.transaction() as cursor:
+            self._create_tables(cursor)
+        
+        # Bring older database files up to the current schema
+        self.migrate()
         
+        # Initialize user progress if doesn't exist
+        self.init_user_progress()
+    
+    def _create_tables(self, cursor):
+        """Create any tables that don't exist yet"""
         # Create scans table
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS scans (
@@ -50,84 +181,603 @@ class Database:
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         """)
+    
+    def get_migrations(self):
+        """
+        Schema migrations in order; migration N brings the schema to version N
         
-        conn.commit()
-        conn.close()
+        Each migration is idempotent, so one interrupted before its version
+        was recorded can simply run again.
+        """
+        return [
+            self._add_created_ts,
+            self._backfill_created_ts,
+            self._add_scan_artifacts,
+            self._compact_legacy_analysis_data,
+            self._add_scan_key,
+            self._add_scan_summary,
+            self._add_scan_rollups,
+            self._index_rollup_buckets,
+        ]
+    
+    def get_schema_version(self):
+        """Schema version recorded in PRAGMA user_version"""
+        with self.connection() as conn:
+            return conn.execute("PRAGMA user_version").fetchone()[0]
+    
+    def migrate(self):
+        """Apply pending migrations and return the resulting schema version"""
+        version = self.get_schema_version()
+        for target, migration in enumerate(self.get_migrations(), start=1):
+            if target <= version:
+                continue
+            migration()
+            with self.transaction() as cursor:
+                # Another process may have migrated meanwhile; never go backwards
+                cursor.execute("PRAGMA user_version")
+                if cursor.fetchone()[0] < target:
+                    cursor.execute(f"PRAGMA user_version = {target}")
+            version = target
+        return version
+    
+    def _add_created_ts(self):
+        """Migration 1: integer epoch timestamps with a covering index"""
+        with self.transaction() as cursor:
+            cursor.execute("PRAGMA table_info(scans)")
+            columns = [row[1] for row in cursor.fetchall()]
+            if 'created_ts' not in columns:
+                cursor.execute("ALTER TABLE scans ADD COLUMN created_ts INTEGER")
+            
+            # Covers history, recent-scan and trend queries without touching rows
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_scans_created_ts
+                ON scans (created_ts, id, date, overall_score, yellowness_score,
+                          cavity_score, alignment_score)
+            """)
+    
+    def _backfill_created_ts(self, batch_size=500):
+        """Migration 2: fill created_ts for existing rows, one batch per transaction"""
+        while True:
+            with self.transaction() as cursor:
+                # created_at is UTC; fall back to the local-time date string
+                cursor.execute("""
+                    UPDATE scans
+                    SET created_ts = COALESCE(
+                        CAST(strftime('%s', created_at) AS INTEGER),
+                        CAST(strftime('%s', date, 'utc') AS INTEGER),
+                        0)
+                    WHERE id IN (
+                        SELECT id FROM scans WHERE created_ts IS NULL LIMIT ?
+                    )
+                """, (batch_size,))
+                if cursor.rowcount < batch_size:
+                    return
+    
+    def _add_scan_artifacts(self):
+        """Migration 3: table of binary scan artifacts (masks, thumbnails, arrays)"""
+        with self.transaction() as cursor:
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS scan_artifacts (
+                    scan_id INTEGER NOT NULL REFERENCES scans(id),
+                    kind TEXT NOT NULL,
+                    encoding TEXT NOT NULL,
+                    meta TEXT NOT NULL,
+                    data BLOB NOT NULL,
+                    PRIMARY KEY (scan_id, kind)
+                ) WITHOUT ROWID
+            """)
+    
+    def _compact_legacy_analysis_data(self, batch_size=200):
+        """
+        Migration 4: drop stringified arrays from older scan rows
         
-        # Initialize user progress if doesn't exist
-        self.init_user_progress()
+        Earlier versions stored str() of every non-primitive value, so masks
+        and images are truncated reprs that cannot be recovered. Severity
+        dicts are parsed back; array reprs are removed.
+        """
+        last_id = 0
+        while True:
+            with self.transaction() as cursor:
+                cursor.execute("""
+                    SELECT id, analysis_data FROM scans
+                    WHERE id > ? AND analysis_data IS NOT NULL
+                    ORDER BY id LIMIT ?
+                """, (last_id, batch_size))
+                rows = cursor.fetchall()
+                if not rows:
+                    return
+                last_id = rows[-1][0]
+                
+                updates = []
+                for scan_id, analysis_data in rows:
+                    compacted = self._compact_analysis_data(analysis_data)
+                    if compacted != analysis_data:
+                        updates.append((compacted, scan_id))
+                cursor.executemany("UPDATE scans SET analysis_data = ? WHERE id = ?", updates)
+    
+    @staticmethod
+    def _compact_analysis_data(analysis_data):
+        """Rewrite one legacy analysis_data value in the compact form"""
+        try:
+            data = json.loads(analysis_data)
+        except ValueError:
+            return analysis_data
+        if not isinstance(data, dict) or 'artifacts' in data:
+            return analysis_data
+        
+        compacted = {}
+        for key, value in data.items():
+            if isinstance(value, str) and value.startswith('{'):
+                try:
+                    value = ast.literal_eval(value)
+                except (ValueError, SyntaxError):
+                    continue
+            elif isinstance(value, str) and value.startswith('['):
+                continue
+            compacted[key] = value
+        compacted['artifacts'] = []
+        return json.dumps(compacted)
+    
+    def _add_scan_key(self):
+        """Migration 5: unique scan_key so each analysis is stored once"""
+        with self.transaction() as cursor:
+            cursor.execute("PRAGMA table_info(scans)")
+            columns = [row[1] for row in cursor.fetchall()]
+            if 'scan_key' not in columns:
+                cursor.execute("ALTER TABLE scans ADD COLUMN scan_key TEXT")
+            
+            # Rows saved with a key in their metadata keep it; repeats of the
+            # same key (saved again on a rerun) are left without one
+            cursor.execute("""
+                UPDATE scans
+                SET scan_key = json_extract(analysis_data, '$.scan_key')
+                WHERE id IN (
+                    SELECT MIN(id) FROM scans
+                    WHERE json_valid(analysis_data)
+                      AND json_extract(analysis_data, '$.scan_key') IS NOT NULL
+                    GROUP BY json_extract(analysis_data, '$.scan_key')
+                )
+                AND scan_key IS NULL
+            """)
+            cursor.execute("""
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_scans_scan_key
+                ON scans (scan_key)
+            """)
+    
+    def _add_scan_summary(self):
+        """Migration 6: single-row scan summary kept current by triggers"""
+        with self.transaction() as cursor:
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS scan_summary (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    scan_count INTEGER NOT NULL DEFAULT 0,
+                    overall_sum REAL NOT NULL DEFAULT 0,
+                    yellowness_sum REAL NOT NULL DEFAULT 0,
+                    cavity_sum REAL NOT NULL DEFAULT 0,
+                    alignment_sum REAL NOT NULL DEFAULT 0,
+                    latest_scan_id INTEGER,
+                    latest_created_ts INTEGER,
+                    latest_score REAL,
+                    latest_date TEXT
+                )
+            """)
+            
+            latest_scan = LATEST_SCAN_QUERY
+            cursor.execute("""
+                CREATE TRIGGER IF NOT EXISTS scans_summary_insert AFTER INSERT ON scans
+                BEGIN
+                    UPDATE scan_summary
+                    SET scan_count = scan_count + 1,
+                        overall_sum = overall_sum + NEW.overall_score,
+                        yellowness_sum = yellowness_sum + NEW.yellowness_score,
+                        cavity_sum = cavity_sum + NEW.cavity_score,
+                        alignment_sum = alignment_sum + NEW.alignment_score
+                    WHERE id = 1;
+                    
+                    UPDATE scan_summary
+                    SET latest_scan_id = NEW.id,
+                        latest_created_ts = COALESCE(NEW.created_ts, 0),
+                        latest_score = NEW.overall_score,
+                        latest_date = NEW.date
+                    WHERE id = 1
+                      AND (latest_scan_id IS NULL
+                           OR (COALESCE(NEW.created_ts, 0), NEW.id)
+                              > (latest_created_ts, latest_scan_id));
+                END
+            """)
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS scans_summary_delete AFTER DELETE ON scans
+                BEGIN
+                    UPDATE scan_summary
+                    SET scan_count = scan_count - 1,
+                        overall_sum = overall_sum - OLD.overall_score,
+                        yellowness_sum = yellowness_sum - OLD.yellowness_score,
+                        cavity_sum = cavity_sum - OLD.cavity_score,
+                        alignment_sum = alignment_sum - OLD.alignment_score
+                    WHERE id = 1;
+                    
+                    UPDATE scan_summary
+                    SET (latest_scan_id, latest_created_ts, latest_score, latest_date) = ({latest_scan})
+                    WHERE id = 1 AND latest_scan_id = OLD.id;
+                END
+            """)
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS scans_summary_update
+                AFTER UPDATE OF overall_score, yellowness_score, cavity_score,
+                                alignment_score, created_ts, date ON scans
+                BEGIN
+                    UPDATE scan_summary
+                    SET overall_sum = overall_sum - OLD.overall_score + NEW.overall_score,
+                        yellowness_sum = yellowness_sum - OLD.yellowness_score + NEW.yellowness_score,
+                        cavity_sum = cavity_sum - OLD.cavity_score + NEW.cavity_score,
+                        alignment_sum = alignment_sum - OLD.alignment_score + NEW.alignment_score,
+                        (latest_scan_id, latest_created_ts, latest_score, latest_date) = ({latest_scan})
+                    WHERE id = 1;
+                END
+            """)
+            
+            self.rebuild_scan_summary()
+    
+    def rebuild_scan_summary(self):
+        """Recompute the scan summary row from the scans table"""
+        with self.transaction() as cursor:
+            cursor.execute("DELETE FROM scan_summary")
+            cursor.execute("""
+                INSERT INTO scan_summary (id, scan_count, overall_sum, yellowness_sum,
+                                          cavity_sum, alignment_sum)
+                SELECT 1, COUNT(*), COALESCE(SUM(overall_score), 0),
+                       COALESCE(SUM(yellowness_score), 0), COALESCE(SUM(cavity_score), 0),
+                       COALESCE(SUM(alignment_score), 0)
+                FROM scans
+            """)
+            cursor.execute(f"""
+                UPDATE scan_summary
+                SET (latest_scan_id, latest_created_ts, latest_score, latest_date) = ({LATEST_SCAN_QUERY})
+                WHERE id = 1
+            """)
+    
+    def _add_scan_rollups(self):
+        """Migration 7: daily and weekly trend rollups kept current by triggers"""
+        stats_columns = ",\n".join(
+            f"{metric}_{stat} REAL NOT NULL"
+            for metric in ROLLUP_METRICS for stat in ('sum', 'min', 'max'))
+        
+        with self.transaction() as cursor:
+            for granularity, (table, _, _) in ROLLUPS.items():
+                cursor.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {table} (
+                        user_id INTEGER NOT NULL,
+                        bucket TEXT NOT NULL,
+                        scan_count INTEGER NOT NULL,
+                        {stats_columns},
+                        PRIMARY KEY (user_id, bucket)
+                    ) WITHOUT ROWID
+                """)
+                
+                self._create_rollup_triggers(cursor, granularity)
+            
+            self.rebuild_rollups()
+    
+    def _index_rollup_buckets(self):
+        """Migration 8: index the bucket expressions the rollup triggers recompute by"""
+        with self.transaction() as cursor:
+            for granularity, (table, bucket, _) in ROLLUPS.items():
+                cursor.execute(f"""
+                    CREATE INDEX IF NOT EXISTS idx_scans_{granularity}_bucket
+                    ON scans ({bucket.format(date='date')})
+                """)
+                
+                # The old triggers found the bucket through created_ts, which
+                # missed rows whose date was edited without their created_ts
+                cursor.execute(f"DROP TRIGGER IF EXISTS {table}_delete")
+                cursor.execute(f"DROP TRIGGER IF EXISTS {table}_update")
+                self._create_rollup_triggers(cursor, granularity)
+            
+            self.rebuild_rollups()
+    
+    def _create_rollup_triggers(self, cursor, granularity):
+        """Create the scans triggers keeping one rollup table current"""
+        table, bucket, _ = ROLLUPS[granularity]
+        
+        # Inserts fold into the bucket; deletes and edits recompute it,
+        # since a minimum or maximum can't be taken back incrementally
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_insert AFTER INSERT ON scans
+            BEGIN
+                {self._rollup_upsert_sql(granularity)};
+            END
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_delete AFTER DELETE ON scans
+            BEGIN
+                {self._rollup_recompute_sql(granularity, bucket.format(date='OLD.date'))};
+            END
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_update
+            AFTER UPDATE OF {', '.join(ROLLUP_METRICS)}, date ON scans
+            BEGIN
+                {self._rollup_recompute_sql(granularity, bucket.format(date='OLD.date'))};
+                {self._rollup_recompute_sql(granularity, bucket.format(date='NEW.date'))};
+            END
+        """)
+    
+    @staticmethod
+    def _rollup_upsert_sql(granularity):
+        """Statement adding the NEW scans row to its rollup bucket"""
+        table, bucket, _ = ROLLUPS[granularity]
+        columns = ", ".join(f"{metric}_{stat}" for metric in ROLLUP_METRICS
+                            for stat in ('sum', 'min', 'max'))
+        values = ", ".join(f"NEW.{metric}" for metric in ROLLUP_METRICS for _ in range(3))
+        updates = ",\n".join(
+            f"{metric}_sum = {metric}_sum + excluded.{metric}_sum,\n"
+            f"{metric}_min = MIN({metric}_min, excluded.{metric}_min),\n"
+            f"{metric}_max = MAX({metric}_max, excluded.{metric}_max)"
+            for metric in ROLLUP_METRICS)
+        return f"""
+            INSERT INTO {table} (user_id, bucket, scan_count, {columns})
+            VALUES ({DEFAULT_USER_ID}, {bucket.format(date='NEW.date')}, 1, {values})
+            ON CONFLICT (user_id, bucket) DO UPDATE SET
+                scan_count = scan_count + 1,
+                {updates}
+        """
+    
+    @staticmethod
+    def _rollup_aggregate_sql(granularity, where):
+        """SELECT of rollup rows from the scans matching where, one per bucket"""
+        table, bucket, _ = ROLLUPS[granularity]
+        aggregates = ", ".join(f"SUM({metric}), MIN({metric}), MAX({metric})"
+                               for metric in ROLLUP_METRICS)
+        return f"""
+            SELECT {DEFAULT_USER_ID}, {bucket.format(date='date')} AS rollup_bucket,
+                   COUNT(*), {aggregates}
+            FROM scans
+            WHERE {where}
+            GROUP BY rollup_bucket
+        """
+    
+    @staticmethod
+    def _rollup_recompute_sql(granularity, bucket_value):
+        """Statements rebuilding the rollup row for one bucket from scans"""
+        table, bucket, _ = ROLLUPS[granularity]
+        
+        # Buckets come from date alone, found with the bucket expression index
+        where = f"{bucket.format(date='date')} = {bucket_value}"
+        return f"""
+            DELETE FROM {table}
+            WHERE user_id = {DEFAULT_USER_ID} AND bucket = {bucket_value};
+            
+            INSERT INTO {table}
+            {Database._rollup_aggregate_sql(granularity, where)}
+        """
+    
+    def rebuild_rollups(self, granularities=None):
+        """
+        Recompute trend rollups from the scans table
+        
+        Args:
+            granularities: 'day' and/or 'week'; all of them by default
+        """
+        with self.transaction() as cursor:
+            for granularity in granularities or ROLLUPS:
+                table = ROLLUPS[granularity][0]
+                cursor.execute(f"DELETE FROM {table}")
+                cursor.execute(f"INSERT INTO {table} "
+                               + self._rollup_aggregate_sql(granularity, "1"))
     
     def init_user_progress(self):
         """Initialize user progress record if it doesn't exist"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self.transaction() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM user_progress")
+            count = cursor.fetchone()[0]
+            
+            if count == 0:
+                cursor.execute("""
+                    INSERT INTO user_progress (stars, coins, total_scans)
+                    VALUES (0, 0, 0)
+                """)
+    
+    def save_scan_results(self, results, image=None):
+        """
+        Save scan results to database
+        
+        Args:
+            results: Result of TeethAnalyzer.analyze_teeth
+            image: Optional scanned image, stored as a JPEG thumbnail
+        
+        Returns:
+            id of the new scan row, or None if a scan with the same
+            scan_key was already saved (nothing is written then)
+        """
+        return self.record_scan_outcome(results, image=image)['scan_id']
+    
+    def record_scan_outcome(self, results, stars_earned=0, coins_earned=0, image=None):
+        """
+        Save a scan, bump scan totals and apply its rewards in one transaction
+        
+        Args:
+            results: Result of TeethAnalyzer.analyze_teeth
+            stars_earned: Stars awarded for this scan
+            coins_earned: Coins awarded for this scan
+            image: Optional scanned image, stored as a JPEG thumbnail
+        
+        Returns:
+            dict with 'scan_id' (None if this scan_key was already saved, in
+            which case nothing is written) and the resulting user progress
+        """
+        
+        # Prepare data: compact metadata in the row, masks and images as artifacts
+        now = datetime.now()
+        date_str = now.strftime("%Y-%m-%d %H:%M:%S")
+        metadata, artifacts = split_results(results, image)
+        analysis_data = json.dumps(metadata)
+        
+        with self.transaction() as cursor:
+            # Insert scan record, once per scan_key
+            cursor.execute(INSERT_SCAN_SQL, (
+                date_str,
+                results['overall_score'],
+                results['yellowness_score'],
+                results['cavity_score'],
+                results['alignment_score'],
+                analysis_data,
+                int(now.timestamp()),
+                results.get('scan_key')
+            ))
+            scan_id = cursor.lastrowid if cursor.rowcount else None
+            
+            if scan_id is not None:
+                cursor.executemany(INSERT_ARTIFACT_SQL, [
+                    (scan_id, kind, encoding, json.dumps(meta), data)
+                    for kind, (encoding, meta, data) in artifacts.items()
+                ])
+                
+                # Update user progress and rewards together
+                cursor.execute("""
+                    UPDATE user_progress 
+                    SET total_scans = total_scans + 1,
+                        stars = stars + ?,
+                        coins = coins + ?,
+                        last_scan_date = ?,
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE id = 1
+                """, (stars_earned, coins_earned, date_str))
+            
+            # Read back the new state inside the same transaction
+            progress = self.get_user_progress()
+        
+        progress['scan_id'] = scan_id
+        return progress
+    
+    def save_scan_results_many(self, results, chunk_size=500):
+        """
+        Bulk-insert scan results, one transaction per chunk
+        
+        Results whose scan_key is already stored (or repeated within the
+        import) are skipped. A result may carry a 'date'
+        ("%Y-%m-%d %H:%M:%S", e.g. rows exported by get_all_scans) to
+        import it at its original time.
+        
+        Args:
+            results: Iterable of analysis results; consumed lazily
+            chunk_size: Results per transaction
         
-        cursor.execute("SELECT COUNT(*) FROM user_progress")
-        count = cursor.fetchone()[0]
+        Returns:
+            number of scans inserted
+        """
+        results = iter(results)
+        inserted = 0
+        while True:
+            chunk = list(islice(results, chunk_size))
+            if not chunk:
+                return inserted
+            inserted += self._save_scan_chunk(chunk)
+    
+    def _save_scan_chunk(self, chunk):
+        """Insert one chunk of results with its artifacts and progress update"""
+        now = datetime.now()
+        
+        rows = {}
+        artifacts = {}
+        for results in chunk:
+            # Keyless results get a key so their artifacts can be matched up
+            scan_key = results.get('scan_key') or uuid.uuid4().hex
+            if scan_key in rows:
+                continue
+            
+            metadata, scan_artifacts = split_results(results)
+            date_str = metadata.pop('date', None)
+            scan_time = datetime.strptime(date_str, "%Y-%m-%d %H:%M:%S") if date_str else now
+            metadata['scan_key'] = scan_key
+            
+            rows[scan_key] = (
+                scan_time.strftime("%Y-%m-%d %H:%M:%S"),
+                results['overall_score'],
+                results['yellowness_score'],
+                results['cavity_score'],
+                results['alignment_score'],
+                json.dumps(metadata),
+                int(scan_time.timestamp()),
+                scan_key
+            )
+            artifacts[scan_key] = scan_artifacts
         
-        if count == 0:
+        with self.transaction() as cursor:
+            # Drop scans stored by an earlier save or import
+            keys = list(rows)
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                cursor.execute("SELECT scan_key FROM scans WHERE scan_key IN ({})".format(
+                    ", ".join("?" * len(batch))), batch)
+                for (scan_key,) in cursor.fetchall():
+                    del rows[scan_key]
+            if not rows:
+                return 0
+            
+            cursor.executemany(INSERT_SCAN_SQL, rows.values())
+            
+            # Map the new rows' ids back through their scan keys
+            scan_ids = {}
+            keys = list(rows)
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                cursor.execute("SELECT scan_key, id FROM scans WHERE scan_key IN ({})".format(
+                    ", ".join("?" * len(batch))), batch)
+                scan_ids.update(cursor.fetchall())
+            
+            cursor.executemany(INSERT_ARTIFACT_SQL, [
+                (scan_ids[scan_key], kind, encoding, json.dumps(meta), data)
+                for scan_key in rows
+                for kind, (encoding, meta, data) in artifacts[scan_key].items()
+            ])
+            
+            # One progress update for the whole chunk
             cursor.execute("""
-                INSERT INTO user_progress (stars, coins, total_scans)
-                VALUES (0, 0, 0)
-            """)
-            conn.commit()
+                UPDATE user_progress 
+                SET total_scans = total_scans + ?,
+                    last_scan_date = MAX(COALESCE(last_scan_date, ''), ?),
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = 1
+            """, (len(rows), max(row[0] for row in rows.values())))
         
-        conn.close()
+        return len(rows)
     
-    def save_scan_results(self, results):
-        """Save scan results to database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    def get_scan_artifacts(self, scan_id, kinds=None):
+        """
+        Load the stored artifacts of a scan
         
-        # Prepare data
-        date_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        analysis_data = json.dumps({
-            key: str(value) if not isinstance(value, (int, float, str, bool, type(None))) else value
-            for key, value in results.items() 
-            if key not in ['overall_score', 'yellowness_score', 'cavity_score', 'alignment_score']
-        })
+        Args:
+            scan_id: id returned by save_scan_results
+            kinds: Artifact kinds to load (e.g. 'teeth_mask', 'thumbnail');
+                all of them by default
         
-        # Insert scan record
-        cursor.execute("""
-            INSERT INTO scans (date, overall_score, yellowness_score, cavity_score, 
-                             alignment_score, analysis_data)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (
-            date_str,
-            results['overall_score'],
-            results['yellowness_score'],
-            results['cavity_score'],
-            results['alignment_score'],
-            analysis_data
-        ))
-        
-        # Update user progress
-        cursor.execute("""
-            UPDATE user_progress 
-            SET total_scans = total_scans + 1,
-                last_scan_date = ?,
-                updated_at = CURRENT_TIMESTAMP
-            WHERE id = 1
-        """, (date_str,))
+        Returns:
+            dict of kind to decoded array
+        """
+        query = "SELECT kind, encoding, meta, data FROM scan_artifacts WHERE scan_id = ?"
+        params = [scan_id]
+        if kinds is not None:
+            kinds = list(kinds)
+            query += " AND kind IN ({})".format(", ".join("?" * len(kinds)))
+            params.extend(kinds)
         
-        conn.commit()
-        conn.close()
+        with self.connection() as conn:
+            rows = conn.execute(query, params).fetchall()
         
-        return cursor.lastrowid
+        return {kind: decode_artifact(encoding, meta, data)
+                for kind, encoding, meta, data in rows}
     
     def get_all_scans(self):
         """Get all scan results ordered by date"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT date, overall_score, yellowness_score, cavity_score, alignment_score
-            FROM scans
-            ORDER BY created_at ASC
-        """)
+        with self.connection() as conn:
+            rows = conn.execute("""
+                SELECT date, overall_score, yellowness_score, cavity_score, alignment_score
+                FROM scans
+                ORDER BY created_ts ASC, id ASC
+            """).fetchall()
         
         results = []
-        for row in cursor.fetchall():
+        for row in rows:
             results.append({
                 'date': row[0],
                 'overall_score': row[1],
@@ -136,23 +786,82 @@ class Database:
                 'alignment_score': row[4]
             })
         
-        conn.close()
         return results
     
+    def get_scans_page(self, page_size=50, cursor=None, direction='older'):
+        """
+        Keyset-paginated scan history
+        
+        Args:
+            page_size: Maximum scans per page
+            cursor: (created_ts, id) position from a previous page's
+                older_cursor/newer_cursor; None starts at the newest scan
+                ('older') or the oldest one ('newer')
+            direction: 'older' for scans before the cursor, 'newer' for after
+        
+        Returns:
+            dict with 'scans' (oldest first), 'older_cursor', 'newer_cursor',
+            'has_older' and 'has_newer'
+        """
+        if direction not in ('older', 'newer'):
+            raise ValueError(f"Unknown page direction: {direction}")
+        
+        # Seek on the (created_ts, id) index; one extra row tells if there's more
+        where = ""
+        params = []
+        if cursor is not None:
+            where = "WHERE (created_ts, id) {} (?, ?)".format('<' if direction == 'older' else '>')
+            params.extend(cursor)
+        order = 'DESC' if direction == 'older' else 'ASC'
+        params.append(page_size + 1)
+        
+        with self.connection() as conn:
+            rows = conn.execute("""
+                SELECT id, created_ts, date, overall_score, yellowness_score,
+                       cavity_score, alignment_score
+                FROM scans
+                {}
+                ORDER BY created_ts {}, id {}
+                LIMIT ?
+            """.format(where, order, order), params).fetchall()
+        
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if direction == 'older':
+            rows.reverse()
+        
+        scans = []
+        for row in rows:
+            scans.append({
+                'id': row[0],
+                'created_ts': row[1],
+                'date': row[2],
+                'overall_score': row[3],
+                'yellowness_score': row[4],
+                'cavity_score': row[5],
+                'alignment_score': row[6]
+            })
+        
+        return {
+            'scans': scans,
+            'older_cursor': (scans[0]['created_ts'], scans[0]['id']) if scans else None,
+            'newer_cursor': (scans[-1]['created_ts'], scans[-1]['id']) if scans else None,
+            'has_older': has_more if direction == 'older' else cursor is not None,
+            'has_newer': has_more if direction == 'newer' else cursor is not None,
+        }
+    
     def get_recent_scans(self, limit=5):
         """Get recent scan results"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT date, overall_score
-            FROM scans
-            ORDER BY created_at DESC
-            LIMIT ?
-        """, (limit,))
+        with self.connection() as conn:
+            rows = conn.execute("""
+                SELECT date, overall_score
+                FROM scans
+                ORDER BY created_ts DESC, id DESC
+                LIMIT ?
+            """, (limit,)).fetchall()
         
         results = []
-        for row in cursor.fetchall():
+        for row in rows:
             # Format date for display
             date_obj = datetime.strptime(row[0], "%Y-%m-%d %H:%M:%S")
             formatted_date = date_obj.strftime("%m/%d")
@@ -162,22 +871,16 @@ class Database:
                 'overall_score': row[1]
             })
         
-        conn.close()
         return results
     
     def get_user_progress(self):
         """Get user progress including stars and coins"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT stars, coins, total_scans, last_scan_date
-            FROM user_progress
-            WHERE id = 1
-        """)
-        
-        row = cursor.fetchone()
-        conn.close()
+        with self.connection() as conn:
+            row = conn.execute("""
+                SELECT stars, coins, total_scans, last_scan_date
+                FROM user_progress
+                WHERE id = 1
+            """).fetchone()
         
         if row:
             return {
@@ -191,34 +894,44 @@ class Database:
     
     def update_user_rewards(self, stars_earned=0, coins_earned=0):
         """Update user rewards (stars and coins)"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self.transaction() as cursor:
+            cursor.execute("""
+                UPDATE user_progress 
+                SET stars = stars + ?, 
+                    coins = coins + ?,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = 1
+            """, (stars_earned, coins_earned))
+    
+    def get_progress_trends(self, days=30, granularity=None, user_id=DEFAULT_USER_ID):
+        """
+        Get progress trends for the last N days
         
-        cursor.execute("""
-            UPDATE user_progress 
-            SET stars = stars + ?, 
-                coins = coins + ?,
-                updated_at = CURRENT_TIMESTAMP
-            WHERE id = 1
-        """, (stars_earned, coins_earned))
+        Args:
+            days: How far back to look
+            granularity: None for every scan, or 'day'/'week' for rollups
+                holding the mean score (plus scan_count and per-metric
+                _min/_max) of each bucket
+            user_id: Owner of the rollups to read
         
-        conn.commit()
-        conn.close()
-    
-    def get_progress_trends(self, days=30):
-        """Get progress trends for the last N days"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        Returns:
+            list of dicts with 'date' and the four scores, oldest first
+        """
+        if granularity is not None:
+            return self._get_rollup_trends(days, granularity, user_id)
         
-        cursor.execute("""
-            SELECT date, overall_score, yellowness_score, cavity_score, alignment_score
-            FROM scans
-            WHERE date >= date('now', '-{} days')
-            ORDER BY created_at ASC
-        """.format(days))
+        # Scans from midnight N days ago onwards, as an index range scan
+        start = datetime.combine(datetime.now().date() - timedelta(days=days), datetime.min.time())
+        with self.connection() as conn:
+            rows = conn.execute("""
+                SELECT date, overall_score, yellowness_score, cavity_score, alignment_score
+                FROM scans
+                WHERE created_ts >= ?
+                ORDER BY created_ts ASC, id ASC
+            """, (int(start.timestamp()),)).fetchall()
         
         results = []
-        for row in cursor.fetchall():
+        for row in rows:
             results.append({
                 'date': row[0],
                 'overall_score': row[1],
@@ -227,38 +940,63 @@ class Database:
                 'alignment_score': row[4]
             })
         
-        conn.close()
         return results
     
-    def save_reminder(self, reminder_type, reminder_text, scheduled_date):
-        """Save a reminder"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    def _get_rollup_trends(self, days, granularity, user_id):
+        """Rollup buckets covering the last N days"""
+        if granularity not in ROLLUPS:
+            raise ValueError(f"Unknown trend granularity: {granularity}")
+        table = ROLLUPS[granularity][0]
         
-        cursor.execute("""
-            INSERT INTO reminders (reminder_type, reminder_text, scheduled_date)
-            VALUES (?, ?, ?)
-        """, (reminder_type, reminder_text, scheduled_date))
+        # First bucket: the day N days ago, or the Monday of its week
+        start = datetime.now().date() - timedelta(days=days)
+        if granularity == 'week':
+            start -= timedelta(days=start.weekday())
+        
+        stats_columns = ", ".join(f"{metric}_{stat}" for metric in ROLLUP_METRICS
+                                  for stat in ('sum', 'min', 'max'))
+        with self.connection() as conn:
+            rows = conn.execute(f"""
+                SELECT bucket, scan_count, {stats_columns}
+                FROM {table}
+                WHERE user_id = ? AND bucket >= ?
+                ORDER BY bucket ASC
+            """, (user_id, start.isoformat())).fetchall()
         
-        conn.commit()
-        conn.close()
+        results = []
+        for row in rows:
+            trend = {'date': row[0], 'scan_count': row[1]}
+            for i, metric in enumerate(ROLLUP_METRICS):
+                total, low, high = row[2 + 3 * i:5 + 3 * i]
+                trend[metric] = total / row[1]
+                trend[metric.replace('_score', '_min')] = low
+                trend[metric.replace('_score', '_max')] = high
+            results.append(trend)
+        
+        return results
+    
+    def save_reminder(self, reminder_type, reminder_text, scheduled_date):
+        """Save a reminder"""
+        with self.transaction() as cursor:
+            cursor.execute("""
+                INSERT INTO reminders (reminder_type, reminder_text, scheduled_date)
+                VALUES (?, ?, ?)
+            """, (reminder_type, reminder_text, scheduled_date))
         
         return cursor.lastrowid
     
     def get_active_reminders(self):
         """Get all active reminders"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT id, reminder_type, reminder_text, scheduled_date
-            FROM reminders
-            WHERE is_active = 1
-            ORDER BY scheduled_date ASC
-        """)
+        with self.connection() as conn:
+            rows = conn.execute("""
+                SELECT id, reminder_type, reminder_text, scheduled_date
+                FROM reminders
+                WHERE is_active = 1
+                ORDER BY scheduled_date ASC
+            """).fetchall()
         
         results = []
-        for row in cursor.fetchall():
+        for row in rows:
             results.append({
                 'id': row[0],
                 'type': row[1],
@@ -266,62 +1004,70 @@ class Database:
                 'date': row[3]
             })
         
-        conn.close()
         return results
     
     def get_stats_summary(self):
         """Get summary statistics"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Get total scans
-        cursor.execute("SELECT COUNT(*) FROM scans")
-        total_scans = cursor.fetchone()[0]
-        
-        # Get average scores
-        cursor.execute("""
-            SELECT AVG(overall_score), AVG(yellowness_score), 
-                   AVG(cavity_score), AVG(alignment_score)
-            FROM scans
-        """)
-        
-        averages = cursor.fetchone()
-        
-        # Get latest scan
-        cursor.execute("""
-            SELECT overall_score, date
-            FROM scans
-            ORDER BY created_at DESC
-            LIMIT 1
-        """)
         
-        latest_scan = cursor.fetchone()
+        # Running totals from the trigger-maintained summary row
+        with self.connection() as conn:
+            row = conn.execute("""
+                SELECT s.scan_count, s.overall_sum, s.yellowness_sum, s.cavity_sum,
+                       s.alignment_sum, s.latest_score, s.latest_date,
+                       p.stars, p.coins
+                FROM scan_summary s
+                LEFT JOIN user_progress p ON p.id = 1
+                WHERE s.id = 1
+            """).fetchone()
         
-        # Get user progress
-        user_progress = self.get_user_progress()
+        total_scans = row[0] if row else 0
         
-        conn.close()
+        def average(total):
+            return total / total_scans if total_scans else 0
         
         return {
             'total_scans': total_scans,
-            'avg_overall_score': averages[0] if averages[0] else 0,
-            'avg_yellowness_score': averages[1] if averages[1] else 0,
-            'avg_cavity_score': averages[2] if averages[2] else 0,
-            'avg_alignment_score': averages[3] if averages[3] else 0,
-            'latest_score': latest_scan[0] if latest_scan else 0,
-            'latest_date': latest_scan[1] if latest_scan else None,
-            'stars': user_progress['stars'],
-            'coins': user_progress['coins']
+            'avg_overall_score': average(row[1]) if row else 0,
+            'avg_yellowness_score': average(row[2]) if row else 0,
+            'avg_cavity_score': average(row[3]) if row else 0,
+            'avg_alignment_score': average(row[4]) if row else 0,
+            'latest_score': row[5] if row and row[5] is not None else 0,
+            'latest_date': row[6] if row else None,
+            'stars': row[7] if row and row[7] is not None else 0,
+            'coins': row[8] if row and row[8] is not None else 0
         }
     
     def clear_all_data(self):
         """Clear all data (for testing/reset purposes)"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute("DELETE FROM scans")
-        cursor.execute("DELETE FROM reminders")
-        cursor.execute("UPDATE user_progress SET stars=0, coins=0, total_scans=0, last_scan_date=NULL")
-        
-        conn.commit()
-        conn.close()
+        with self.transaction() as cursor:
+            # Drop the summary and rollup triggers rather than run them per row
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'scans'")
+            for (trigger,) in cursor.fetchall():
+                cursor.execute(f"DROP TRIGGER {trigger}")
+            
+            cursor.execute("DELETE FROM scan_artifacts")
+            cursor.execute("DELETE FROM scans")
+            cursor.execute("DELETE FROM reminders")
+            cursor.execute("UPDATE user_progress SET stars=0, coins=0, total_scans=0, last_scan_date=NULL")
+            
+            # Recreate the triggers and rebuild the (now empty) summaries
+            self._add_scan_summary()
+            self._add_scan_rollups()
+
+
+if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Smilo database maintenance")
+    parser.add_argument('command', choices=['migrate', 'rebuild-rollups', 'rebuild-summary'])
+    parser.add_argument('--db', default=os.environ.get('SMILO_DB_PATH', 'smilo.db'))
+    args = parser.parse_args()
+    
+    # Opening the database applies any pending migrations
+    db = Database(args.db)
+    if args.command == 'rebuild-rollups':
+        db.rebuild_rollups()
+    elif args.command == 'rebuild-summary':
+        db.rebuild_scan_summary()
+    print(f"{args.db}: schema version {db.get_schema_version()}")
+    db.close()
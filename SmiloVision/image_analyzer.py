@@ -1,17 +1,359 @@
+import copy
 import cv2
+import io
 import numpy as np
 from PIL import Image
-from skimage import filters, morphology, measure
-import matplotlib.pyplot as plt
-from matplotlib.patches import Circle, Ellipse
-import io
+import os
+import threading
+import uuid
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import replace
+from functools import cached_property, lru_cache
+from analysis_result import AnalysisResult
+from overlay_renderer import (OverlayLayerCache, layer_to_rgba, output_size,
+                              render_layer_masks, render_overlay, visible_layers)
+
+
+# Bump whenever a change alters analysis output, so cached results are not reused
+ALGORITHM_VERSION = 3
+
+# Stages reported to analyze_teeth progress callbacks, in order
+ANALYSIS_STAGES = ('preprocess', 'segment', 'yellowness', 'cavities', 'alignment', 'scoring')
+
+# Per-candidate record for detected dark spots: centroid, bounding box size
+# and contour measurements, all in pixels
+CAVITY_CANDIDATE_DTYPE = np.dtype([
+    ('x', np.float32),
+    ('y', np.float32),
+    ('width', np.float32),
+    ('height', np.float32),
+    ('area', np.float32),
+    ('perimeter', np.float32),
+    ('circularity', np.float32),
+])
+
+
+def measure_contours(contours):
+    """
+    Measure many contours at once with vectorized polygon formulas
+    
+    Area, closed arc length and centroid use the same shoelace and Green's
+    theorem sums as cv2.contourArea, cv2.arcLength and cv2.moments, reduced
+    per contour with np.add.reduceat instead of one call per contour.
+    
+    Returns:
+        dict of float64 arrays with one entry per contour: x, y, width,
+        height, area, perimeter and circularity (0 where undefined), plus
+        the bounding box edges left, top, right and bottom (inclusive)
+    """
+    count = len(contours)
+    if count == 0:
+        empty = np.empty(0, dtype=np.float64)
+        names = CAVITY_CANDIDATE_DTYPE.names + ('left', 'top', 'right', 'bottom')
+        return {name: empty for name in names}
+    
+    lengths = np.fromiter((len(c) for c in contours), dtype=np.intp, count=count)
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    points = np.concatenate(contours).reshape(-1, 2).astype(np.float64)
+    x, y = points[:, 0], points[:, 1]
+    
+    # Each point's successor, wrapping to the first point of its own contour
+    successor = np.arange(len(points)) + 1
+    successor[starts + lengths - 1] = starts
+    x_next, y_next = x[successor], y[successor]
+    
+    cross = x * y_next - x_next * y
+    signed_area = np.add.reduceat(cross, starts) / 2.0
+    perimeter = np.add.reduceat(np.hypot(x_next - x, y_next - y), starts)
+    moment_x = np.add.reduceat((x + x_next) * cross, starts) / 6.0
+    moment_y = np.add.reduceat((y + y_next) * cross, starts) / 6.0
+    
+    area = np.abs(signed_area)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        centroid_x = np.where(signed_area != 0, moment_x / signed_area,
+                              np.add.reduceat(x, starts) / lengths)
+        centroid_y = np.where(signed_area != 0, moment_y / signed_area,
+                              np.add.reduceat(y, starts) / lengths)
+        circularity = np.where(perimeter > 0, 4 * np.pi * area / (perimeter * perimeter), 0.0)
+    
+    left, right = np.minimum.reduceat(x, starts), np.maximum.reduceat(x, starts)
+    top, bottom = np.minimum.reduceat(y, starts), np.maximum.reduceat(y, starts)
+    return {
+        'x': centroid_x,
+        'y': centroid_y,
+        'width': right - left + 1,
+        'height': bottom - top + 1,
+        'area': area,
+        'perimeter': perimeter,
+        'circularity': circularity,
+        'left': left,
+        'top': top,
+        'right': right,
+        'bottom': bottom,
+    }
+
+
+# Bits of the per-pixel class map: teeth color, then one bit per stain range
+PIXEL_TEETH = 0x01
+PIXEL_STAIN_PRIMARY = 0x02
+PIXEL_STAIN_SECONDARY = 0x04
+
+
+@lru_cache(maxsize=2)
+def build_pixel_class_lut(teeth_range, stain_ranges):
+    """
+    Precompute the class bits of every 24-bit RGB color
+    
+    Args:
+        teeth_range: (lower, upper) HSV bounds for teeth color
+        stain_ranges: Up to seven (lower, upper) HSV stain bounds; range i
+            sets bit PIXEL_STAIN_PRIMARY << i
+            
+    Returns:
+        uint8 array of 2**24 entries indexed by (r << 16) | (g << 8) | b
+    """
+    ranges = [(PIXEL_TEETH, teeth_range)]
+    ranges += [(PIXEL_STAIN_PRIMARY << i, bounds) for i, bounds in enumerate(stain_ranges)]
+    
+    lut = np.empty(1 << 24, dtype=np.uint8)
+    
+    # Classify 16 red levels (1M colors) at a time to bound temporary memory
+    green, blue = np.divmod(np.arange(1 << 16, dtype=np.uint32), 256)
+    block = np.empty((16, 1 << 16, 3), dtype=np.uint8)
+    block[:, :, 1] = green
+    block[:, :, 2] = blue
+    for red in range(0, 256, 16):
+        block[:, :, 0] = np.arange(red, red + 16, dtype=np.uint8)[:, None]
+        hsv = cv2.cvtColor(block.reshape(1024, 1024, 3), cv2.COLOR_RGB2HSV)
+        classes = np.zeros((1024, 1024), dtype=np.uint8)
+        for bit, (lower, upper) in ranges:
+            in_range = cv2.inRange(hsv, np.array(lower), np.array(upper))
+            classes |= in_range & bit
+        lut[red << 16:(red + 16) << 16] = classes.reshape(-1)
+    
+    return lut
+
+
+def classify_pixels(img_rgb, lut):
+    """Look up the class bits of every pixel of an RGB uint8 image in one gather"""
+    # BGRA bytes read as little-endian uint32 give (r << 16) | (g << 8) | b plus alpha
+    packed = cv2.cvtColor(img_rgb, cv2.COLOR_RGB2BGRA).view('<u4')[..., 0]
+    packed &= 0xFFFFFF
+    return np.take(lut, packed)
+
+
+class AnalysisContext:
+    """Lazily computed color planes for one processed image.
+
+    Every plane is derived on first access and reused by all detectors, so an
+    analysis converts the image at most once per color space.
+    """
+
+    def __init__(self, image, teeth_mask=None, origin=(0, 0), class_lut=None,
+                 frame_shape=None):
+        self.image = image
+        self.teeth_mask = teeth_mask
+        # RGB-to-class table from build_pixel_class_lut
+        self.class_lut = class_lut
+        # Offset of this image within the full analysis frame, and that
+        # frame's height and width
+        self.origin = origin
+        self.frame_shape = frame_shape or image.shape[:2]
+        # Artifacts recorded by the detectors for overlays; the stain mask
+        # covers this image, candidates and contour are in frame coordinates
+        self.stain_mask = None
+        self.cavity_candidates = np.empty(0, dtype=CAVITY_CANDIDATE_DTYPE)
+        self.alignment_contour = None
+
+    def set_teeth_mask(self, teeth_mask):
+        """Attach the teeth mask, dropping planes derived from a previous one"""
+        self.teeth_mask = teeth_mask
+        self.__dict__.pop('masked_gray', None)
+
+    def crop(self, rect):
+        """
+        Return a context for a sub-rectangle of this image
+        
+        Planes already computed here are shared as views instead of being
+        converted again for the crop.
+        """
+        x, y, w, h = rect
+        rows, cols = slice(y, y + h), slice(x, x + w)
+        mask = self.teeth_mask[rows, cols] if self.teeth_mask is not None else None
+        cropped = AnalysisContext(self.image[rows, cols], mask,
+                                  origin=(self.origin[0] + x, self.origin[1] + y),
+                                  class_lut=self.class_lut,
+                                  frame_shape=self.frame_shape)
+        for plane in ('gray', 'hsv', 'lab', 'masked_gray', 'pixel_classes'):
+            if plane in self.__dict__:
+                cropped.__dict__[plane] = self.__dict__[plane][rows, cols]
+        return cropped
+
+    def cut_edges(self):
+        """
+        Which sides of this image were cut from the frame by cropping
+
+        Returns:
+            tuple of (left, top, right, bottom) booleans
+        """
+        height, width = self.image.shape[:2]
+        frame_height, frame_width = self.frame_shape
+        x, y = self.origin
+        return (x > 0, y > 0, x + width < frame_width, y + height < frame_height)
+
+    @cached_property
+    def gray(self):
+        return cv2.cvtColor(self.image, cv2.COLOR_RGB2GRAY)
+
+    @cached_property
+    def hsv(self):
+        return cv2.cvtColor(self.image, cv2.COLOR_RGB2HSV)
+
+    @cached_property
+    def lab(self):
+        return cv2.cvtColor(self.image, cv2.COLOR_RGB2LAB)
+
+    @cached_property
+    def pixel_classes(self):
+        if self.class_lut is None:
+            raise ValueError("pixel_classes requires a class lookup table")
+        return classify_pixels(self.image, self.class_lut)
+
+    @cached_property
+    def masked_gray(self):
+        if self.teeth_mask is None:
+            raise ValueError("masked_gray requires a teeth mask")
+        return cv2.bitwise_and(self.gray, self.teeth_mask)
+
+
+def load_image_array(source):
+    """Load an RGB array from an array, encoded bytes, a file path or an open file object"""
+    if isinstance(source, np.ndarray):
+        return source
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    with Image.open(source) as image:
+        return np.array(image.convert('RGB'))
+
+
+# Analyzer used by batch worker processes, installed once per worker
+_batch_analyzer = None
+
+
+def _init_batch_worker(analyzer):
+    """Install the batch analyzer and keep OpenCV single-threaded per worker"""
+    global _batch_analyzer
+    _batch_analyzer = analyzer
+    # One OpenCV thread per process avoids oversubscribing cores across the pool
+    cv2.setNumThreads(1)
+
+
+def _batch_error(index, error):
+    """Batch record for an item that could not be analyzed"""
+    return {'index': index, 'result': None, 'error': f"{type(error).__name__}: {error}"}
+
+
+def _batch_payload(source):
+    """Make a batch item sendable to a worker; open files are read to bytes"""
+    if hasattr(source, 'read'):
+        return source.read()
+    return source
+
+
+def _analyze_batch_item(index, source, include_arrays, analyzer=None):
+    """Analyze one batch item, reporting failures instead of raising"""
+    analyzer = analyzer or _batch_analyzer
+    try:
+        result = analyzer.analyze_teeth(load_image_array(source))
+        if not include_arrays and result.processed_image is not None:
+            result = replace(result, processed_image=None)
+        return {'index': index, 'result': result, 'error': None}
+    except Exception as e:
+        return _batch_error(index, e)
+
 
 class TeethAnalyzer:
-    def __init__(self):
+    def __init__(self, cache=None):
+        # Optional AnalysisCache for results of previously seen images
+        self.cache = cache
+        
+        # Compressed overlay layers of recent scans, keyed by scan and size
+        self.layer_cache = OverlayLayerCache()
+        
         self.blur_threshold = 100
         self.brightness_min = 50
         self.brightness_max = 200
         
+        # Keep a reference to the working-resolution processed image in results
+        self.keep_processed_image = False
+        
+        # Longest image side used for analysis; larger uploads are downscaled
+        # first and masks are mapped back to full resolution (None disables)
+        self.max_working_size = 1280
+        
+        # Margin in pixels kept around the teeth bounding box for later stages
+        self.roi_margin = 16
+        
+        # Dark spot size limits (in working-resolution pixels)
+        self.cavity_min_area = 15
+        self.cavity_max_area = 800
+        self.cavity_min_circularity = 0.3
+        
+        # HSV color bounds for teeth segmentation and stain detection
+        self.teeth_hsv_range = ((0, 0, 120), (40, 80, 255))
+        self.stain_hsv_ranges = (
+            ((18, 40, 100), (35, 255, 255)),
+            ((10, 20, 120), (25, 100, 220)),
+        )
+        
+        # Preprocessing parameters
+        self.clahe_clip_limit = 2.0
+        self.clahe_tile_grid = (8, 8)
+        self.gamma = 1.2
+        # CLAHE operators keep scratch buffers, so each thread gets its own
+        self._clahe_local = threading.local()
+        # (gamma, table) pair, swapped as one so concurrent readers agree
+        self._gamma_lut = None
+    
+    def __getstate__(self):
+        # OpenCV CLAHE objects can't be pickled; workers rebuild theirs lazily
+        state = self.__dict__.copy()
+        del state['_clahe_local']
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._clahe_local = threading.local()
+    
+    def _get_clahe(self):
+        """Return this thread's CLAHE operator, built once per configuration"""
+        local = self._clahe_local
+        params = (self.clahe_clip_limit, tuple(self.clahe_tile_grid))
+        if getattr(local, 'params', None) != params:
+            local.clahe = cv2.createCLAHE(clipLimit=params[0], tileGridSize=params[1])
+            local.params = params
+        return local.clahe
+    
+    def get_pixel_class_lut(self):
+        """Return the RGB-to-class table for the current HSV bounds"""
+        # Tables are cached per bounds, so changing them triggers a rebuild
+        teeth_range = tuple(tuple(bound) for bound in self.teeth_hsv_range)
+        stain_ranges = tuple(tuple(tuple(bound) for bound in bounds)
+                             for bounds in self.stain_hsv_ranges)
+        return build_pixel_class_lut(teeth_range, stain_ranges)
+    
+    def _get_gamma_lut(self):
+        """Return the 256-entry uint8 gamma table for the current gamma"""
+        gamma, cached = self.gamma, self._gamma_lut
+        if cached is None or cached[0] != gamma:
+            # Same arithmetic and truncation as the per-pixel float formula
+            levels = np.arange(256, dtype=np.float64) / 255.0
+            cached = (gamma, (np.power(levels, gamma) * 255.0).astype(np.uint8))
+            self._gamma_lut = cached
+        return cached[1]
+        
     def check_image_quality(self, img_array):
         """Check image quality for lighting, blur, and framing"""
         
@@ -100,21 +442,81 @@ class TeethAnalyzer:
         }
         return colors.get(severity, '#95A5A6')
     
-    def analyze_teeth(self, img_array):
-        """Comprehensive teeth analysis with severity classification"""
+    def get_config(self):
+        """Settings that influence analysis results, used in cache keys"""
+        return {
+            'max_working_size': self.max_working_size,
+            'roi_margin': self.roi_margin,
+            'cavity_min_area': self.cavity_min_area,
+            'cavity_max_area': self.cavity_max_area,
+            'cavity_min_circularity': self.cavity_min_circularity,
+            'clahe_clip_limit': self.clahe_clip_limit,
+            'clahe_tile_grid': tuple(self.clahe_tile_grid),
+            'gamma': self.gamma,
+            'teeth_hsv_range': self.teeth_hsv_range,
+            'stain_hsv_ranges': self.stain_hsv_ranges,
+            'keep_processed_image': self.keep_processed_image,
+        }
+    
+    def analyze_teeth(self, img_array, progress_callback=None):
+        """
+        Comprehensive teeth analysis with severity classification
+        
+        Args:
+            img_array: RGB image array
+            progress_callback: Optional callable(stage, status), called with
+                status 'start' and 'done' around each of ANALYSIS_STAGES, or
+                once as ('cached', 'done') when the result comes from the cache
+        """
+        
+        def notify(stage, status):
+            if progress_callback is not None:
+                progress_callback(stage, status)
+        
+        # Identical pixels under the same configuration give identical results
+        if self.cache is not None:
+            cache_key = self.cache.make_key(img_array, self.get_config(), ALGORITHM_VERSION)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                notify('cached', 'done')
+                # Same pixels, but a new scan: give it its own identity
+                return replace(cached, scan_key=uuid.uuid4().hex)
+        
+        # Segmentation and scoring run at working resolution
+        notify('preprocess', 'start')
+        working_img, scale = self.to_working_resolution(img_array)
         
         # Preprocessing
-        processed_img = self.preprocess_image(img_array)
+        processed_img = self.preprocess_image(working_img)
+        context = AnalysisContext(processed_img, class_lut=self.get_pixel_class_lut())
+        notify('preprocess', 'done')
         
         # Extract teeth region
-        teeth_mask = self.extract_teeth_region(processed_img)
+        notify('segment', 'start')
+        teeth_mask = self.extract_teeth_region(processed_img, context)
+        context.set_teeth_mask(teeth_mask)
+        
+        # Later stages only need the teeth bounding box, not lips and background
+        roi_context = context.crop(self.teeth_roi(teeth_mask))
+        roi_img = roi_context.image
+        roi_mask = roi_context.teeth_mask
+        notify('segment', 'done')
         
         # Perform individual analyses
-        yellowness_score = self.detect_yellowness(processed_img, teeth_mask)
-        cavity_score = self.detect_cavities(processed_img, teeth_mask)
-        alignment_score = self.evaluate_alignment(processed_img, teeth_mask)
+        notify('yellowness', 'start')
+        yellowness_score = self.detect_yellowness(roi_img, roi_mask, roi_context)
+        notify('yellowness', 'done')
+        
+        notify('cavities', 'start')
+        cavity_score = self.detect_cavities(roi_img, roi_mask, roi_context)
+        notify('cavities', 'done')
+        
+        notify('alignment', 'start')
+        alignment_score = self.evaluate_alignment(roi_img, roi_mask, roi_context)
+        notify('alignment', 'done')
         
         # Calculate overall score
+        notify('scoring', 'start')
         overall_score = self.calculate_overall_score(
             yellowness_score, cavity_score, alignment_score)
         
@@ -123,17 +525,236 @@ class TeethAnalyzer:
         cavity_severity = self.classify_severity('cavity', cavity_score)
         alignment_severity = self.classify_severity('alignment', alignment_score)
         
-        return {
-            'overall_score': overall_score,
-            'yellowness_score': yellowness_score,
-            'yellowness_severity': yellowness_severity,
-            'cavity_score': cavity_score,
-            'cavity_severity': cavity_severity,
-            'alignment_score': alignment_score,
-            'alignment_severity': alignment_severity,
-            'teeth_mask': teeth_mask,
-            'processed_image': processed_img
-        }
+        # Place the ROI stain mask back into the working frame
+        stain_mask = np.zeros_like(teeth_mask)
+        roi_x, roi_y = roi_context.origin
+        roi_height, roi_width = roi_mask.shape
+        stain_mask[roi_y:roi_y + roi_height, roi_x:roi_x + roi_width] = roi_context.stain_mask
+        
+        # Map overlay artifacts back to the original image coordinates
+        cavity_candidates = roi_context.cavity_candidates.copy()
+        alignment_contour = roi_context.alignment_contour
+        if scale != (1.0, 1.0):
+            scale_x, scale_y = scale
+            full_size = (img_array.shape[1], img_array.shape[0])
+            teeth_mask = cv2.resize(teeth_mask, full_size, interpolation=cv2.INTER_NEAREST)
+            stain_mask = cv2.resize(stain_mask, full_size, interpolation=cv2.INTER_NEAREST)
+            for name in ('x', 'width'):
+                cavity_candidates[name] /= scale_x
+            for name in ('y', 'height'):
+                cavity_candidates[name] /= scale_y
+            cavity_candidates['area'] /= scale_x * scale_y
+            # Rounding makes the axes differ by well under 1%; the geometric
+            # mean keeps perimeter consistent with area (circularity unchanged)
+            cavity_candidates['perimeter'] /= np.sqrt(scale_x * scale_y)
+            if alignment_contour is not None:
+                alignment_contour = np.round(
+                    alignment_contour / np.array([scale_x, scale_y])).astype(np.int32)
+        
+        results = AnalysisResult.from_arrays(
+            teeth_mask,
+            stain_mask,
+            overall_score=overall_score,
+            yellowness_score=yellowness_score,
+            yellowness_severity=yellowness_severity,
+            cavity_score=cavity_score,
+            cavity_severity=cavity_severity,
+            alignment_score=alignment_score,
+            alignment_severity=alignment_severity,
+            cavity_candidates=cavity_candidates,
+            alignment_contour=alignment_contour,
+            working_scale=scale,
+            processed_image=processed_img if self.keep_processed_image else None
+        )
+        
+        # Results are immutable, so cached entries are shared as-is
+        if self.cache is not None:
+            self.cache.put(cache_key, results)
+        notify('scoring', 'done')
+        
+        return results
+    
+    def teeth_roi(self, teeth_mask):
+        """
+        Bounding box of the teeth mask grown by roi_margin, clipped to the frame
+        
+        Returns:
+            tuple of (x, y, width, height); the whole frame if the mask is
+            empty or the background left inside the box would be small
+            enough to pass for a cavity
+        """
+        height, width = teeth_mask.shape[:2]
+        full_frame = (0, 0, width, height)
+        
+        x, y, w, h = cv2.boundingRect(teeth_mask)
+        if w == 0 or h == 0:
+            return full_frame
+        
+        x0 = max(x - self.roi_margin, 0)
+        y0 = max(y - self.roi_margin, 0)
+        x1 = min(x + w + self.roi_margin, width)
+        y1 = min(y + h + self.roi_margin, height)
+        
+        # The box holds the whole mask, so the rest of it is background
+        background = (x1 - x0) * (y1 - y0) - cv2.countNonZero(teeth_mask)
+        if background <= self.cavity_max_area:
+            return full_frame
+        
+        return (x0, y0, x1 - x0, y1 - y0)
+    
+    def to_working_resolution(self, img_array):
+        """
+        Downscale an image so its longest side fits max_working_size
+        
+        Returns:
+            tuple of (working image, (x, y) scale factors from original to
+            working size)
+        """
+        height, width = img_array.shape[:2]
+        longest = max(height, width)
+        
+        if not self.max_working_size or longest <= self.max_working_size:
+            return img_array, (1.0, 1.0)
+        
+        scale = self.max_working_size / longest
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        working = cv2.resize(img_array, size, interpolation=cv2.INTER_AREA)
+        
+        # Sizes are rounded per axis, so report the ratio actually applied to each
+        return working, (size[0] / width, size[1] / height)
+    
+    def analyze_batch(self, images, max_workers=None, ordered=True,
+                      include_arrays=False, max_pending=None):
+        """
+        Analyze many images over a process pool
+        
+        Args:
+            images: Iterable of RGB arrays, file paths or open file objects
+                (files are read in this process before being handed to a worker)
+            max_workers: Worker processes (defaults to the CPU count; 1 runs inline)
+            ordered: Yield in input order if True, otherwise in completion order
+            include_arrays: Keep processed_image in each result, even if
+                keep_processed_image is off (the compact teeth mask is always
+                kept)
+            max_pending: Cap on queued items (defaults to 4 per worker), so
+                large iterables are consumed lazily
+            
+        Yields:
+            dict with 'index', 'result' and 'error' for every input item;
+            a failed item has result None and a short error description. If a
+            worker process dies the pool is restarted and the rest of the
+            batch carries on.
+        """
+        max_workers = max_workers or os.cpu_count() or 1
+        
+        # processed_image only exists if the analyzer is asked to keep it
+        analyzer = self
+        if include_arrays and not self.keep_processed_image:
+            analyzer = copy.copy(self)
+            analyzer.keep_processed_image = True
+        
+        if max_workers == 1:
+            for index, source in enumerate(images):
+                yield _analyze_batch_item(index, source, include_arrays, analyzer=analyzer)
+            return
+        
+        max_pending = max_pending or max_workers * 4
+        items = enumerate(images)
+        
+        def start_pool():
+            return ProcessPoolExecutor(max_workers=max_workers,
+                                       initializer=_init_batch_worker,
+                                       initargs=(analyzer,))
+        
+        executor = start_pool()
+        pending = {}        # future -> item index
+        sources = {}        # item index -> payload, kept until the item finishes
+        suspects = deque()  # items queued when a worker died, retried one at a time
+        submitted = deque()
+        finished = {}
+        exhausted = False
+        
+        try:
+            while True:
+                ready = []
+                to_submit = []
+                isolated = None
+                
+                if suspects:
+                    # Run suspects alone so a crash can be pinned on one item
+                    if not pending:
+                        isolated = suspects.popleft()
+                        to_submit.append(isolated)
+                else:
+                    # Keep the pool fed without materializing the whole input
+                    while not exhausted and len(sources) + len(finished) < max_pending:
+                        try:
+                            index, source = next(items)
+                        except StopIteration:
+                            exhausted = True
+                            break
+                        submitted.append(index)
+                        try:
+                            sources[index] = _batch_payload(source)
+                        except Exception as e:
+                            ready.append(_batch_error(index, e))
+                            continue
+                        to_submit.append(index)
+                
+                broken = False
+                for position, index in enumerate(to_submit):
+                    try:
+                        future = executor.submit(_analyze_batch_item, index,
+                                                 sources[index], include_arrays)
+                    except BrokenProcessPool:
+                        suspects.extend(to_submit[position:])
+                        broken = True
+                        break
+                    pending[future] = index
+                
+                if pending and not broken:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        index = pending[future]
+                        try:
+                            item = future.result()
+                        except BrokenProcessPool:
+                            broken = True
+                            continue
+                        except Exception as e:
+                            item = _batch_error(index, e)
+                        del pending[future]
+                        del sources[index]
+                        ready.append(item)
+                
+                if broken:
+                    # A worker died (e.g. out of memory) and took every queued
+                    # item with it; blame an item only if it was running alone
+                    lost = sorted(pending.values())
+                    pending.clear()
+                    if lost == [isolated]:
+                        del sources[isolated]
+                        ready.append({'index': isolated, 'result': None,
+                                      'error': "BrokenProcessPool: worker process died"})
+                    else:
+                        suspects.extend(lost)
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    executor = start_pool()
+                
+                for item in ready:
+                    if ordered:
+                        finished[item['index']] = item
+                    else:
+                        yield item
+                
+                # Release results whose predecessors have all finished
+                while ordered and submitted and submitted[0] in finished:
+                    yield finished.pop(submitted.popleft())
+                
+                if exhausted and not sources and not finished:
+                    break
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
     
     def preprocess_image(self, img_array):
         """Preprocess image for analysis"""
@@ -146,29 +767,39 @@ class TeethAnalyzer:
         
         # Apply CLAHE for contrast enhancement
         lab = cv2.cvtColor(img_rgb, cv2.COLOR_RGB2LAB)
-        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
-        lab[:,:,0] = clahe.apply(lab[:,:,0])
-        enhanced = cv2.cvtColor(lab, cv2.COLOR_LAB2RGB)
+        lightness, a_channel, b_channel = cv2.split(lab)
+        lightness = self._get_clahe().apply(lightness)
+        enhanced = cv2.cvtColor(cv2.merge((lightness, a_channel, b_channel)), cv2.COLOR_LAB2RGB)
         
         # Gamma correction for brightness normalization
-        gamma = 1.2
-        enhanced = np.power(enhanced / 255.0, gamma) * 255.0
-        enhanced = enhanced.astype(np.uint8)
+        if enhanced.dtype == np.uint8:
+            # Table lookup keeps the whole stage in uint8, with no float temporaries
+            enhanced = cv2.LUT(enhanced, self._get_gamma_lut(), dst=enhanced)
+        else:
+            enhanced = np.power(enhanced / 255.0, self.gamma) * 255.0
+            enhanced = enhanced.astype(np.uint8)
         
         return enhanced
     
-    def extract_teeth_region(self, img_array):
+    def _get_context(self, img_array, teeth_mask, context):
+        """Return the shared analysis context, building one for standalone calls"""
+        if context is None:
+            context = AnalysisContext(img_array, teeth_mask,
+                                      class_lut=self.get_pixel_class_lut())
+        elif teeth_mask is not None and context.teeth_mask is not teeth_mask:
+            context.set_teeth_mask(teeth_mask)
+        return context
+    
+    def extract_teeth_region(self, img_array, context=None):
         """Extract teeth region using improved color-based segmentation"""
         
-        # Convert to HSV for better color segmentation
-        hsv = cv2.cvtColor(img_array, cv2.COLOR_RGB2HSV)
+        # Per-pixel classes from the HSV color lookup table
+        context = self._get_context(img_array, None, context)
+        classes = context.pixel_classes
         
-        # Expanded range for teeth color (white/off-white/cream/light yellow)
-        lower_teeth = np.array([0, 0, 120])
-        upper_teeth = np.array([40, 80, 255])
-        
-        # Create mask for teeth
-        teeth_mask = cv2.inRange(hsv, lower_teeth, upper_teeth)
+        # Create mask for teeth color (white/off-white/cream/light yellow)
+        # (NumPy rather than cv2.compare, which treats a 1x1 array as a scalar)
+        teeth_mask = np.where(classes & PIXEL_TEETH, 255, 0).astype(np.uint8)
         
         # Morphological operations to clean up mask
         kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
@@ -190,31 +821,22 @@ class TeethAnalyzer:
         
         return teeth_mask
     
-    def detect_yellowness(self, img_array, teeth_mask):
+    def detect_yellowness(self, img_array, teeth_mask, context=None):
         """Detect yellow staining on teeth with improved color detection"""
         
-        # Convert to HSV
-        hsv = cv2.cvtColor(img_array, cv2.COLOR_RGB2HSV)
-        
-        # Convert to LAB color space for better yellow detection
-        lab = cv2.cvtColor(img_array, cv2.COLOR_RGB2LAB)
-        
-        # Define multiple yellow/stain color ranges for better detection
-        lower_yellow1 = np.array([18, 40, 100])
-        upper_yellow1 = np.array([35, 255, 255])
-        
-        lower_yellow2 = np.array([10, 20, 120])
-        upper_yellow2 = np.array([25, 100, 220])
-        
-        # Create yellow masks
-        yellow_mask1 = cv2.inRange(hsv, lower_yellow1, upper_yellow1)
-        yellow_mask2 = cv2.inRange(hsv, lower_yellow2, upper_yellow2)
+        # Pixel classes shared with teeth segmentation
+        context = self._get_context(img_array, teeth_mask, context)
+        classes = context.pixel_classes
         
-        # Combine masks
-        yellow_mask = cv2.bitwise_or(yellow_mask1, yellow_mask2)
+        # Any of the yellow/stain color ranges counts as staining
+        stain_bits = 0
+        for i in range(len(self.stain_hsv_ranges)):
+            stain_bits |= PIXEL_STAIN_PRIMARY << i
+        yellow_mask = np.where(classes & stain_bits, 255, 0).astype(np.uint8)
         
         # Combine with teeth mask
         yellow_on_teeth = cv2.bitwise_and(yellow_mask, teeth_mask)
+        context.stain_mask = yellow_on_teeth
         
         # Calculate yellowness percentage
         teeth_pixels = np.sum(teeth_mask > 0)
@@ -230,14 +852,13 @@ class TeethAnalyzer:
             
         return min(yellowness_percentage, 100)
     
-    def detect_cavities(self, img_array, teeth_mask):
+    def detect_cavities(self, img_array, teeth_mask, context=None):
         """Detect potential cavities with FIXED algorithm to prevent 100% readings"""
         
-        # Convert to grayscale
-        gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
-        
-        # Apply teeth mask
-        masked_gray = cv2.bitwise_and(gray, teeth_mask)
+        # Grayscale and masked grayscale planes
+        context = self._get_context(img_array, teeth_mask, context)
+        gray = context.gray
+        masked_gray = context.masked_gray
         
         # Only process if we have teeth pixels
         teeth_pixels = np.sum(teeth_mask > 0)
@@ -262,23 +883,43 @@ class TeethAnalyzer:
         # Find contours of dark spots
         contours, _ = cv2.findContours(cleaned, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
         
-        # Filter contours by size and shape (cavity-like dimensions)
-        cavity_contours = []
-        min_area = 15
-        max_area = 800
-        
-        for contour in contours:
-            area = cv2.contourArea(contour)
-            if min_area < area < max_area:
-                # Check circularity to filter out non-cavity shapes
-                perimeter = cv2.arcLength(contour, True)
-                if perimeter > 0:
-                    circularity = 4 * np.pi * area / (perimeter * perimeter)
-                    if circularity > 0.3:
-                        cavity_contours.append(contour)
+        # Measure every blob at once
+        blobs = measure_contours(contours)
+        
+        # Filter by size and shape (cavity-like dimensions and circularity)
+        area = blobs['area']
+        is_cavity = (
+            (area > self.cavity_min_area) &
+            (area < self.cavity_max_area) &
+            (blobs['perimeter'] > 0) &
+            (blobs['circularity'] > self.cavity_min_circularity)
+        )
+        
+        # Background cut off by the teeth ROI is open to the rest of the frame,
+        # not a dark spot: drop blobs touching an edge the crop cut
+        height, width = gray.shape
+        cut_left, cut_top, cut_right, cut_bottom = context.cut_edges()
+        if cut_left:
+            is_cavity &= blobs['left'] > 0
+        if cut_top:
+            is_cavity &= blobs['top'] > 0
+        if cut_right:
+            is_cavity &= blobs['right'] < width - 1
+        if cut_bottom:
+            is_cavity &= blobs['bottom'] < height - 1
         
         # Calculate cavity risk percentage
-        cavity_pixels = sum([cv2.contourArea(c) for c in cavity_contours])
+        cavity_pixels = area[is_cavity].sum()
+        
+        # Keep the accepted blobs as a candidate table for scoring and overlays
+        candidates = np.empty(np.count_nonzero(is_cavity), dtype=CAVITY_CANDIDATE_DTYPE)
+        for name in CAVITY_CANDIDATE_DTYPE.names:
+            candidates[name] = blobs[name][is_cavity]
+        
+        # Translate from this image to frame coordinates
+        candidates['x'] += context.origin[0]
+        candidates['y'] += context.origin[1]
+        context.cavity_candidates = candidates
         
         # Calculate percentage with proper scaling
         cavity_percentage = (cavity_pixels / teeth_pixels) * 100
@@ -288,14 +929,12 @@ class TeethAnalyzer:
             
         return cavity_percentage
     
-    def evaluate_alignment(self, img_array, teeth_mask):
+    def evaluate_alignment(self, img_array, teeth_mask, context=None):
         """Evaluate teeth alignment with improved algorithm"""
         
-        # Convert to grayscale
-        gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
-        
-        # Apply teeth mask
-        masked_gray = cv2.bitwise_and(gray, teeth_mask)
+        # Masked grayscale plane shared with cavity detection
+        context = self._get_context(img_array, teeth_mask, context)
+        masked_gray = context.masked_gray
         
         # Find edges of teeth with optimized parameters
         edges = cv2.Canny(masked_gray, 30, 120)
@@ -309,6 +948,9 @@ class TeethAnalyzer:
         # Get the main teeth contour
         main_contour = max(contours, key=cv2.contourArea)
         
+        # Keep the outline, in frame coordinates, for the overlay guide
+        context.alignment_contour = main_contour.reshape(-1, 2) + np.array(context.origin, dtype=np.int32)
+        
         # Fit an ellipse to the contour to represent ideal alignment
         if len(main_contour) >= 5:
             try:
@@ -358,119 +1000,47 @@ class TeethAnalyzer:
         
         return min(max(overall, 0), 100)
     
-    def create_visual_overlay(self, img_array, analysis_results):
-        """Create visual overlay showing detected issues"""
+    def get_overlay_layer_masks(self, analysis_results, size=None):
+        """
+        Coverage masks of the staining, cavity and alignment overlay layers
         
-        # Create a copy of the original image
-        overlay_img = img_array.copy()
+        Rendered once per scan and output size, then served from layer_cache.
+        """
+        size = output_size(analysis_results.image_shape, size)
+        key = (analysis_results.scan_key, size)
         
-        # Create figure for matplotlib overlay
-        fig, ax = plt.subplots(1, 1, figsize=(10, 8))
-        ax.imshow(overlay_img)
-        ax.set_title("Smilo Analysis Results", fontsize=16, fontweight='bold')
+        layer_masks = self.layer_cache.get(key)
+        if layer_masks is None:
+            layer_masks = render_layer_masks(analysis_results, size)
+            self.layer_cache.put(key, layer_masks)
         
-        # Get image dimensions
-        height, width = img_array.shape[:2]
+        return layer_masks
+    
+    def create_overlay_layers(self, analysis_results, size=None):
+        """Separate RGBA image for each overlay layer, for toggling or re-blending"""
+        layer_masks = self.get_overlay_layer_masks(analysis_results, size)
+        return {name: layer_to_rgba(name, coverage) for name, coverage in layer_masks.items()}
+    
+    def create_visual_overlay(self, img_array, analysis_results, size=None, output='pil',
+                              layers=None):
+        """
+        Create visual overlay showing detected issues
         
-        # Overlay yellowness (yellow transparent regions)
-        if analysis_results['yellowness_score'] > 10:
-            # Convert to HSV to find yellow regions
-            hsv = cv2.cvtColor(img_array, cv2.COLOR_RGB2HSV)
-            lower_yellow = np.array([18, 40, 100])
-            upper_yellow = np.array([35, 255, 255])
-            yellow_mask = cv2.inRange(hsv, lower_yellow, upper_yellow)
-            
-            # Apply teeth mask
-            teeth_mask = analysis_results['teeth_mask']
-            yellow_on_teeth = cv2.bitwise_and(yellow_mask, teeth_mask)
-            
-            # Create yellow overlay
-            yellow_overlay = np.zeros_like(overlay_img)
-            yellow_overlay[yellow_on_teeth > 0] = [255, 255, 0]
-            
-            # Blend with original
-            alpha = 0.3
-            overlay_img = cv2.addWeighted(overlay_img, 1-alpha, yellow_overlay, alpha, 0)
+        Args:
+            img_array: Original image the analysis ran on
+            analysis_results: Result of analyze_teeth
+            size: None for the default display size, an int longest side,
+                or a (width, height) tuple
+            output: 'pil' for a PIL Image, 'array' for an RGB array, or
+                'png', 'jpeg' or 'webp' for encoded bytes
+            layers: Layer names to show ('staining', 'cavities', 'alignment');
+                defaults to the layers the scores call for
+        """
+        if layers is None:
+            layers = visible_layers(analysis_results)
         
-        # Overlay cavity indicators (red circles) - FIXED to show actual cavities
-        if analysis_results['cavity_score'] > 2:
-            # Find dark spots as potential cavities
-            gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
-            masked_gray = cv2.bitwise_and(gray, analysis_results['teeth_mask'])
-            
-            # Get average brightness
-            teeth_pixels = gray[analysis_results['teeth_mask'] > 0]
-            if len(teeth_pixels) > 0:
-                avg_brightness = np.mean(teeth_pixels)
-                threshold_value = max(30, int(avg_brightness * 0.6))
-                
-                # Binary threshold
-                _, binary = cv2.threshold(masked_gray, threshold_value, 255, cv2.THRESH_BINARY_INV)
-                
-                kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2, 2))
-                cleaned = cv2.morphologyEx(binary, cv2.MORPH_OPEN, kernel, iterations=1)
-                
-                contours, _ = cv2.findContours(cleaned, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-                
-                # Draw circles around potential cavities
-                for contour in contours:
-                    area = cv2.contourArea(contour)
-                    if 15 < area < 800:
-                        perimeter = cv2.arcLength(contour, True)
-                        if perimeter > 0:
-                            circularity = 4 * np.pi * area / (perimeter * perimeter)
-                            if circularity > 0.3:
-                                # Get centroid
-                                M = cv2.moments(contour)
-                                if M["m00"] != 0:
-                                    cx = int(M["m10"] / M["m00"])
-                                    cy = int(M["m01"] / M["m00"])
-                                    
-                                    # Draw circle
-                                    circle = Circle((cx, cy), radius=15, fill=False, 
-                                                  color='red', linewidth=3, alpha=0.8)
-                                    ax.add_patch(circle)
-        
-        # Overlay alignment indicators (blue outlines)
-        if analysis_results['alignment_score'] < 80:
-            # Find main teeth contour
-            gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
-            masked_gray = cv2.bitwise_and(gray, analysis_results['teeth_mask'])
-            edges = cv2.Canny(masked_gray, 30, 120)
-            contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            
-            if contours:
-                main_contour = max(contours, key=cv2.contourArea)
-                
-                # Draw contour outline in blue
-                contour_points = main_contour.reshape(-1, 2)
-                if len(contour_points) > 0:
-                    ax.plot(contour_points[:, 0], contour_points[:, 1], 
-                           'b-', linewidth=2, alpha=0.7, label='Alignment Guide')
-        
-        # Add legend
-        legend_elements = []
-        if analysis_results['yellowness_score'] > 10:
-            legend_elements.append(plt.Line2D([0], [0], color='yellow', lw=4, alpha=0.7, label='Staining'))
-        if analysis_results['cavity_score'] > 2:
-            legend_elements.append(plt.Line2D([0], [0], marker='o', color='red', lw=0, 
-                                            markersize=10, alpha=0.8, label='Potential Cavities'))
-        if analysis_results['alignment_score'] < 80:
-            legend_elements.append(plt.Line2D([0], [0], color='blue', lw=2, alpha=0.7, label='Alignment Issues'))
-        
-        if legend_elements:
-            ax.legend(handles=legend_elements, loc='upper right', bbox_to_anchor=(1, 1))
-        
-        # Remove axes
-        ax.axis('off')
-        
-        # Convert matplotlib figure to image
-        buf = io.BytesIO()
-        plt.savefig(buf, format='png', bbox_inches='tight', dpi=100)
-        plt.close(fig)
-        buf.seek(0)
-        
-        # Convert to PIL Image
-        pil_image = Image.open(buf)
-        
-        return pil_image
+        size = output_size(img_array.shape, size)
+        layer_masks = self.get_overlay_layer_masks(analysis_results, size) if layers else None
+        
+        return render_overlay(img_array, analysis_results, size=size, output=output,
+                              layers=layers, layer_masks=layer_masks)
@@ -0,0 +1,331 @@
+"""
+Overlay compositor for teeth analysis results
+Draws stain tint, cavity rings, alignment outline and legend with OpenCV
+"""
+
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+from PIL import Image
+
+# Longest side of the rendered image when no size is requested
+DEFAULT_MAX_SIDE = 800
+
+# Marker geometry in original image pixels, matching the analysis overlays
+CAVITY_RING_RADIUS = 15
+
+# Colors (RGB) and opacities of each layer
+STAIN_COLOR = (255, 255, 0)
+STAIN_ALPHA = 0.3
+CAVITY_COLOR = (255, 0, 0)
+CAVITY_ALPHA = 0.8
+ALIGNMENT_COLOR = (0, 0, 255)
+ALIGNMENT_ALPHA = 0.7
+
+# Stroke widths in output pixels (3 pt and 2 pt at 100 dpi)
+CAVITY_THICKNESS = 4
+ALIGNMENT_THICKNESS = 3
+
+TITLE = "Smilo Analysis Results"
+TITLE_HEIGHT = 40
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+
+# Layer colors and opacities, in drawing order
+LAYER_STYLES = {
+    'staining': (STAIN_COLOR, STAIN_ALPHA),
+    'cavities': (CAVITY_COLOR, CAVITY_ALPHA),
+    'alignment': (ALIGNMENT_COLOR, ALIGNMENT_ALPHA),
+}
+LAYER_NAMES = tuple(LAYER_STYLES)
+
+ENCODINGS = {'png': '.png', 'jpeg': '.jpg', 'jpg': '.jpg', 'webp': '.webp'}
+
+
+def visible_layers(analysis_results):
+    """Names of the layers the scores call for, in drawing order"""
+    layers = []
+    if analysis_results['yellowness_score'] > 10:
+        layers.append('staining')
+    if analysis_results['cavity_score'] > 2:
+        layers.append('cavities')
+    if analysis_results['alignment_score'] < 80:
+        layers.append('alignment')
+    return layers
+
+
+def output_size(image_shape, size=None):
+    """
+    Resolve the requested output size for an image
+
+    Args:
+        image_shape: Shape of the original image
+        size: None for DEFAULT_MAX_SIDE, an int longest side, or (width, height)
+
+    Returns:
+        tuple of (width, height)
+    """
+    height, width = image_shape[:2]
+    if isinstance(size, (tuple, list)):
+        return int(size[0]), int(size[1])
+
+    max_side = size or DEFAULT_MAX_SIDE
+    scale = min(1.0, max_side / max(height, width))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def to_rgb(img_array):
+    """Return a 3-channel RGB uint8 view of a gray, RGB or RGBA image"""
+    if img_array.ndim == 2:
+        return cv2.cvtColor(img_array, cv2.COLOR_GRAY2RGB)
+    if img_array.shape[2] == 4:
+        return cv2.cvtColor(img_array, cv2.COLOR_RGBA2RGB)
+    return img_array
+
+
+def staining_coverage(stain_mask, size):
+    """Coverage mask of stained teeth pixels at the output size"""
+    width, height = size
+    if stain_mask.shape[:2] != (height, width):
+        stain_mask = cv2.resize(stain_mask, (width, height), interpolation=cv2.INTER_NEAREST)
+    return np.where(stain_mask > 0, 255, 0).astype(np.uint8)
+
+
+def cavities_coverage(cavity_candidates, size, scale):
+    """Coverage mask of a ring around each cavity candidate"""
+    width, height = size
+    coverage = np.zeros((height, width), dtype=np.uint8)
+    radius = max(1, round(CAVITY_RING_RADIUS * scale))
+    for x, y in zip(cavity_candidates['x'], cavity_candidates['y']):
+        center = (round(int(x) * scale), round(int(y) * scale))
+        cv2.circle(coverage, center, radius, 255, CAVITY_THICKNESS, cv2.LINE_AA)
+    return coverage
+
+
+def alignment_coverage(alignment_contour, size, scale):
+    """Coverage mask tracing the main teeth contour"""
+    width, height = size
+    coverage = np.zeros((height, width), dtype=np.uint8)
+    if alignment_contour is not None and len(alignment_contour) > 0:
+        points = np.round(alignment_contour * scale).astype(np.int32).reshape(-1, 1, 2)
+        cv2.polylines(coverage, [points], False, 255, ALIGNMENT_THICKNESS, cv2.LINE_AA)
+    return coverage
+
+
+def render_layer_masks(analysis_results, size=None):
+    """
+    Render the coverage mask (0-255) of every overlay layer
+
+    Args:
+        analysis_results: Result of TeethAnalyzer.analyze_teeth
+        size: Output image size, see output_size
+
+    Returns:
+        dict of layer name to uint8 coverage mask at the output size
+    """
+    stain_mask = analysis_results['stain_mask']
+    size = output_size(stain_mask.shape, size)
+    scale = size[0] / stain_mask.shape[1]
+    return {
+        'staining': staining_coverage(stain_mask, size),
+        'cavities': cavities_coverage(analysis_results['cavity_candidates'], size, scale),
+        'alignment': alignment_coverage(analysis_results['alignment_contour'], size, scale),
+    }
+
+
+def layer_to_rgba(name, coverage):
+    """Expand a layer's coverage mask to an RGBA image with its color and opacity"""
+    color, opacity = LAYER_STYLES[name]
+    rgba = np.empty(coverage.shape + (4,), dtype=np.uint8)
+    rgba[:, :, :3] = color
+    rgba[:, :, 3] = np.round(coverage * opacity).astype(np.uint8)
+    return rgba
+
+
+def composite_layer(canvas, name, coverage):
+    """Alpha-composite one layer onto an RGB canvas in place"""
+    rows, cols = np.nonzero(coverage)
+    if len(rows) == 0:
+        return
+    color, opacity = LAYER_STYLES[name]
+    alpha = (coverage[rows, cols].astype(np.float32) * (opacity / 255.0))[:, None]
+    pixels = canvas[rows, cols].astype(np.float32)
+    canvas[rows, cols] = np.round(pixels + (np.array(color, dtype=np.float32) - pixels) * alpha)
+
+
+def draw_legend(canvas, layers):
+    """Draw a legend box for the given layers in the top-right corner"""
+    entries = {
+        'staining': 'Staining',
+        'cavities': 'Potential Cavities',
+        'alignment': 'Alignment Issues',
+    }
+    labels = [entries[name] for name in layers]
+    if not labels:
+        return
+
+    font_scale, thickness = 0.45, 1
+    text_sizes = [cv2.getTextSize(label, FONT, font_scale, thickness)[0] for label in labels]
+    row_height = max(h for _, h in text_sizes) + 10
+    swatch_width = 28
+    box_width = swatch_width + 16 + max(w for w, _ in text_sizes) + 8
+    box_height = row_height * len(labels) + 8
+
+    x1 = canvas.shape[1] - 6
+    x0 = max(0, x1 - box_width)
+    y0 = 6
+    y1 = min(canvas.shape[0] - 1, y0 + box_height)
+
+    panel = canvas.copy()
+    cv2.rectangle(panel, (x0, y0), (x1, y1), (255, 255, 255), -1)
+    cv2.addWeighted(panel, 0.8, canvas, 0.2, 0, dst=canvas)
+    cv2.rectangle(canvas, (x0, y0), (x1, y1), (204, 204, 204), 1)
+
+    for i, (name, label) in enumerate(zip(layers, labels)):
+        mid_y = y0 + 4 + row_height * i + row_height // 2
+        swatch_x = x0 + 8
+        if name == 'staining':
+            cv2.line(canvas, (swatch_x, mid_y), (swatch_x + swatch_width, mid_y), STAIN_COLOR, 5)
+        elif name == 'cavities':
+            cv2.circle(canvas, (swatch_x + swatch_width // 2, mid_y), 6, CAVITY_COLOR, -1, cv2.LINE_AA)
+        else:
+            cv2.line(canvas, (swatch_x, mid_y), (swatch_x + swatch_width, mid_y),
+                     ALIGNMENT_COLOR, ALIGNMENT_THICKNESS, cv2.LINE_AA)
+        text_y = mid_y + text_sizes[i][1] // 2
+        cv2.putText(canvas, label, (swatch_x + swatch_width + 8, text_y), FONT,
+                    font_scale, (0, 0, 0), thickness, cv2.LINE_AA)
+
+
+def add_title(canvas):
+    """Return the canvas with the report title in a white band above it"""
+    width = canvas.shape[1]
+    framed = np.full((canvas.shape[0] + TITLE_HEIGHT, width, 3), 255, dtype=np.uint8)
+    framed[TITLE_HEIGHT:] = canvas
+
+    font_scale = 0.8
+    (text_width, text_height), _ = cv2.getTextSize(TITLE, FONT, font_scale, 2)
+    origin = (max(0, (width - text_width) // 2), (TITLE_HEIGHT + text_height) // 2)
+    cv2.putText(framed, TITLE, origin, FONT, font_scale, (0, 0, 0), 2, cv2.LINE_AA)
+    return framed
+
+
+def encode_image(canvas, output='pil', quality=90):
+    """
+    Convert a rendered RGB canvas to the requested output
+
+    Args:
+        output: 'array', 'pil', or an encoding name ('png', 'jpeg', 'webp')
+        quality: JPEG/WebP quality
+    """
+    if output == 'array':
+        return canvas
+    if output == 'pil':
+        return Image.fromarray(canvas)
+
+    extension = ENCODINGS.get(output)
+    if extension is None:
+        raise ValueError(f"Unsupported overlay output: {output}")
+
+    params = []
+    if extension == '.jpg':
+        params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+    elif extension == '.webp':
+        params = [cv2.IMWRITE_WEBP_QUALITY, quality]
+    ok, encoded = cv2.imencode(extension, cv2.cvtColor(canvas, cv2.COLOR_RGB2BGR), params)
+    if not ok:
+        raise ValueError(f"Could not encode overlay as {output}")
+    return encoded.tobytes()
+
+
+def render_overlay(img_array, analysis_results, size=None, output='pil', quality=90,
+                   layers=None, layer_masks=None):
+    """
+    Composite the analysis overlay onto an image
+
+    Args:
+        img_array: Original image the analysis ran on
+        analysis_results: Result of TeethAnalyzer.analyze_teeth
+        size: Output image size, see output_size
+        output: 'pil', 'array' or an encoding name, see encode_image
+        layers: Layer names to draw (defaults to visible_layers)
+        layer_masks: Coverage masks from render_layer_masks at this size,
+            rendered on demand if not given
+
+    Returns:
+        PIL Image, RGB array or encoded bytes
+    """
+    img_rgb = to_rgb(img_array)
+    width, height = output_size(img_rgb.shape, size)
+
+    if (width, height) == (img_rgb.shape[1], img_rgb.shape[0]):
+        canvas = img_rgb.copy()
+    else:
+        canvas = cv2.resize(img_rgb, (width, height), interpolation=cv2.INTER_AREA)
+
+    if layers is None:
+        layers = visible_layers(analysis_results)
+    layers = [name for name in LAYER_NAMES if name in layers]
+
+    if layers:
+        if layer_masks is None:
+            layer_masks = render_layer_masks(analysis_results, (width, height))
+        for name in layers:
+            composite_layer(canvas, name, layer_masks[name])
+    draw_legend(canvas, layers)
+
+    return encode_image(add_title(canvas), output, quality)
+
+
+class OverlayLayerCache:
+    """
+    LRU cache of overlay layer coverage masks, keyed by scan and size
+
+    Masks are stored PNG-compressed; sparse overlay layers shrink to a
+    few kilobytes each.
+    """
+
+    def __init__(self, max_entries=128):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # Cached layers stay in this process
+        return {'max_entries': self.max_entries}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def get(self, key):
+        """Return the decoded layer masks for key, or None"""
+        with self._lock:
+            encoded = self._entries.get(key)
+            if encoded is None:
+                return None
+            self._entries.move_to_end(key)
+        return {name: cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_GRAYSCALE)
+                for name, data in encoded.items()}
+
+    def put(self, key, layer_masks):
+        """Compress and store layer masks under key"""
+        encoded = {}
+        for name, coverage in layer_masks.items():
+            ok, data = cv2.imencode('.png', coverage)
+            if ok:
+                encoded[name] = data.tobytes()
+        with self._lock:
+            self._entries[key] = encoded
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    @property
+    def nbytes(self):
+        with self._lock:
+            return sum(len(data) for encoded in self._entries.values()
+                       for data in encoded.values())
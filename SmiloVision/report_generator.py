@@ -8,7 +8,6 @@ from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_JUSTIFY
 from PIL import Image as PILImage
 import io
 from datetime import datetime
-import numpy as np
 
 class ReportGenerator:
     def __init__(self):
@@ -0,0 +1,131 @@
+"""
+Binary artifacts stored alongside scan records
+Masks are kept run-length encoded, images as JPEG thumbnails and
+structured arrays in .npy form
+"""
+
+import io
+import json
+
+import cv2
+import numpy as np
+
+from analysis_result import RunLengthMask, rle_decode
+
+# Longest side of stored scan thumbnails
+THUMBNAIL_MAX_SIDE = 256
+THUMBNAIL_QUALITY = 80
+
+MASK_KEYS = ('teeth_mask', 'stain_mask')
+ARRAY_KEYS = ('cavity_candidates', 'alignment_contour')
+IMAGE_KEYS = ('processed_image',)
+
+# Score fields already stored as scan columns
+SCORE_KEYS = ('overall_score', 'yellowness_score', 'cavity_score', 'alignment_score')
+
+
+def encode_mask(mask):
+    """Run-length encode a mask; accepts arrays or RunLengthMask"""
+    if not isinstance(mask, RunLengthMask):
+        mask = RunLengthMask.encode(np.asarray(mask))
+    meta = {'shape': list(mask.shape), 'first_value': mask.first_value}
+    return 'rle', meta, mask.runs.astype('<u4').tobytes()
+
+
+def encode_thumbnail(img_array):
+    """JPEG thumbnail of an RGB or gray image, longest side THUMBNAIL_MAX_SIDE"""
+    img = np.asarray(img_array)
+    if img.dtype != np.uint8:
+        img = np.clip(img, 0, 255).astype(np.uint8)
+    if img.ndim == 3 and img.shape[2] == 4:
+        img = cv2.cvtColor(img, cv2.COLOR_RGBA2RGB)
+
+    height, width = img.shape[:2]
+    scale = min(1.0, THUMBNAIL_MAX_SIDE / max(height, width))
+    if scale < 1.0:
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        img = cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+
+    if img.ndim == 3:
+        img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
+    ok, data = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, THUMBNAIL_QUALITY])
+    if not ok:
+        raise ValueError("Could not encode scan thumbnail")
+    meta = {'shape': list(img.shape), 'source_shape': [height, width]}
+    return 'jpeg', meta, data.tobytes()
+
+
+def encode_array(array):
+    """Store an arbitrary (structured) array in .npy format"""
+    buffer = io.BytesIO()
+    np.save(buffer, np.asarray(array), allow_pickle=False)
+    return 'npy', {}, buffer.getvalue()
+
+
+def decode_artifact(encoding, meta, data):
+    """
+    Rebuild an artifact from its stored form
+
+    Returns:
+        uint8 mask for 'rle', RGB (or gray) array for 'jpeg', array for 'npy'
+    """
+    if isinstance(meta, str):
+        meta = json.loads(meta)
+
+    if encoding == 'rle':
+        runs = np.frombuffer(data, dtype='<u4')
+        return rle_decode(runs, meta['first_value'], tuple(meta['shape']))
+    if encoding == 'jpeg':
+        img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_UNCHANGED)
+        return cv2.cvtColor(img, cv2.COLOR_BGR2RGB) if img.ndim == 3 else img
+    if encoding == 'npy':
+        return np.load(io.BytesIO(data), allow_pickle=False)
+    raise ValueError(f"Unknown artifact encoding: {encoding}")
+
+
+def split_results(results, image=None):
+    """
+    Split analysis results into compact scan metadata and binary artifacts
+
+    Args:
+        results: AnalysisResult or equivalent dict
+        image: Optional original image, stored as the scan thumbnail
+
+    Returns:
+        tuple of (JSON-serializable metadata dict, dict of kind to
+        (encoding, meta, data))
+    """
+    metadata = {}
+    artifacts = {}
+
+    for key in results:
+        if key in SCORE_KEYS:
+            continue
+        if key in MASK_KEYS:
+            # Reuse the result's own run-length encoding instead of decoding
+            value = getattr(results, 'encoded_' + key, None)
+            if value is None:
+                value = results[key]
+        else:
+            value = results[key]
+        if value is None:
+            continue
+
+        if key in MASK_KEYS:
+            artifacts[key] = encode_mask(value)
+        elif key in ARRAY_KEYS:
+            artifacts[key] = encode_array(value)
+        elif key in IMAGE_KEYS:
+            artifacts[key] = encode_thumbnail(value)
+        elif isinstance(value, np.generic):
+            metadata[key] = value.item()
+        elif isinstance(value, (int, float, str, bool, dict, list, tuple)):
+            metadata[key] = value
+
+    if image is not None:
+        artifacts['thumbnail'] = encode_thumbnail(image)
+
+    if 'cavity_candidates' in results:
+        metadata['cavity_count'] = len(results['cavity_candidates'])
+    metadata['artifacts'] = sorted(artifacts)
+    return metadata, artifacts
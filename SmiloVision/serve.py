@@ -0,0 +1,28 @@
+"""
+Smilo server entry point
+Warms up the analyzer and report generator, then starts Streamlit in the same
+process, so the port only opens once the first scan will be fast.
+
+    python serve.py --server.port 5000
+"""
+
+import logging
+import sys
+
+from warmup import start_warm_up, wait_ready
+
+
+def main():
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    start_warm_up()
+    wait_ready()
+
+    # Streamlit runs app.py in this process, so it shares the warmed services
+    from streamlit.web import cli as stcli
+    sys.argv = ['streamlit', 'run', 'app.py', *sys.argv[1:]]
+    return stcli.main()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
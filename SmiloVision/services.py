@@ -0,0 +1,78 @@
+"""
+Process-wide application services
+The analyzer, report generator, database and tips library are built once per
+process on first use and shared by every session and thread
+"""
+
+import atexit
+import os
+import threading
+
+_services = {}
+# Reentrant so a factory can request the services it depends on
+_lock = threading.RLock()
+
+
+def _get_service(name, factory):
+    """Return the named service, creating it with factory on first use"""
+    service = _services.get(name)
+    if service is None:
+        with _lock:
+            service = _services.get(name)
+            if service is None:
+                service = factory()
+                _services[name] = service
+    return service
+
+
+def get_analysis_cache():
+    """Result cache shared by every analysis in this process"""
+    from analysis_cache import AnalysisCache
+    return _get_service('analysis_cache', lambda: AnalysisCache(
+        disk_dir=os.environ.get('SMILO_CACHE_DIR')))
+
+
+def get_analyzer():
+    """Shared TeethAnalyzer backed by the process result cache"""
+    from image_analyzer import TeethAnalyzer
+    return _get_service('analyzer', lambda: TeethAnalyzer(cache=get_analysis_cache()))
+
+
+def get_report_generator():
+    """Shared PDF report generator (imports reportlab on first use)"""
+    def create():
+        from report_generator import ReportGenerator
+        return ReportGenerator()
+    return _get_service('report_generator', create)
+
+
+def get_database():
+    """Shared database handle"""
+    from database import Database
+    return _get_service('database', lambda: Database(
+        os.environ.get('SMILO_DB_PATH', 'smilo.db')))
+
+
+def get_tips_library():
+    """Shared read-only dental tips library"""
+    from dental_tips_library import DentalTipsLibrary
+    return _get_service('tips_library', DentalTipsLibrary)
+
+
+def shutdown():
+    """
+    Release every service; the next getter call creates a fresh one
+
+    Services with a close() method are closed. Registered to run at exit.
+    """
+    with _lock:
+        services = list(_services.values())
+        _services.clear()
+
+    for service in services:
+        close = getattr(service, 'close', None)
+        if close is not None:
+            close()
+
+
+atexit.register(shutdown)
@@ -0,0 +1,68 @@
+"""
+Edge cases of TeethAnalyzer.analyze_teeth
+
+    python -m unittest discover -s tests
+"""
+
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analysis_cache import AnalysisCache
+from image_analyzer import TeethAnalyzer
+
+BACKGROUND = (90, 20, 30)
+TOOTH = (235, 230, 215)
+
+
+def corner_square(side, size=200):
+    """Dark red frame with one tooth-colored square in the top-left corner"""
+    img = np.empty((size, size, 3), dtype=np.uint8)
+    img[:] = BACKGROUND
+    img[:side, :side] = TOOTH
+    return img
+
+
+class TeethRoiTest(unittest.TestCase):
+    def test_clipped_roi_background_is_not_a_cavity(self):
+        # The ROI margin is clipped by the frame corner, leaving an L of
+        # background inside the crop that is small enough to pass for a cavity
+        for side in (12, 16, 18, 20, 24):
+            with self.subTest(side=side):
+                results = TeethAnalyzer().analyze_teeth(corner_square(side))
+                self.assertEqual(results['cavity_score'], 0)
+                self.assertEqual(len(results['cavity_candidates']), 0)
+
+
+class TinyImageTest(unittest.TestCase):
+    def test_single_pixel(self):
+        # OpenCV treats a 1x1 array as a scalar in some operations
+        for color in (TOOTH, BACKGROUND):
+            with self.subTest(color=color):
+                img = np.full((1, 1, 3), color, dtype=np.uint8)
+                results = TeethAnalyzer().analyze_teeth(img)
+                self.assertEqual(results['teeth_mask'].shape, (1, 1))
+
+
+class ProcessedImageTest(unittest.TestCase):
+    def test_cache_respects_keep_processed_image(self):
+        analyzer = TeethAnalyzer(cache=AnalysisCache())
+        img = corner_square(40)
+        self.assertIsNone(analyzer.analyze_teeth(img).processed_image)
+        analyzer.keep_processed_image = True
+        self.assertIsNotNone(analyzer.analyze_teeth(img).processed_image)
+
+    def test_batch_include_arrays(self):
+        analyzer = TeethAnalyzer()
+        items = list(analyzer.analyze_batch([corner_square(40)], max_workers=1,
+                                            include_arrays=True))
+        self.assertIsNotNone(items[0]['result'].processed_image)
+        self.assertFalse(analyzer.keep_processed_image)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+"""
+Import-time budget for the modules app.py loads before its first screen
+Each import runs in a fresh interpreter so earlier imports cannot hide costs.
+
+    python -m unittest discover -s tests
+"""
+
+import os
+import subprocess
+import sys
+import unittest
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Loaded lazily by the screens and services that need them
+HEAVY_MODULES = ('matplotlib', 'plotly', 'pandas', 'skimage', 'reportlab')
+
+# Cumulative `-X importtime` budget per module, in seconds (OpenCV and NumPy
+# dominate; about 0.25s on a warm disk cache)
+IMPORT_BUDGET_SECONDS = {
+    'image_analyzer': 1.5,
+    'services': 0.25,
+}
+
+
+def import_in_subprocess(module):
+    """
+    Import module in a fresh interpreter
+
+    Returns:
+        tuple of (heavy modules loaded, cumulative import seconds)
+    """
+    code = (f"import sys, {module}; "
+            f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))")
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                          cwd=APP_DIR, capture_output=True, text=True, check=True)
+
+    # importtime lines: "import time: self [us] | cumulative | name"
+    cumulative = None
+    for line in proc.stderr.splitlines():
+        fields = [field.strip() for field in line.split('|')]
+        if len(fields) == 3 and fields[2] == module:
+            cumulative = int(fields[1]) / 1e6
+    loaded = [name for name in proc.stdout.strip().split(',') if name]
+    return loaded, cumulative
+
+
+class ImportBudgetTest(unittest.TestCase):
+    def test_heavy_modules_stay_lazy(self):
+        for module in IMPORT_BUDGET_SECONDS:
+            with self.subTest(module=module):
+                loaded, _ = import_in_subprocess(module)
+                self.assertEqual(loaded, [], f"importing {module} loads {loaded}")
+
+    def test_import_time_budget(self):
+        for module, budget in IMPORT_BUDGET_SECONDS.items():
+            with self.subTest(module=module):
+                _, seconds = import_in_subprocess(module)
+                self.assertIsNotNone(seconds, f"no importtime entry for {module}")
+                self.assertLess(seconds, budget,
+                                f"importing {module} took {seconds:.3f}s")
+
+
+if __name__ == "__main__":
+    unittest.main()
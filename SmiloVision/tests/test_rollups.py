@@ -0,0 +1,64 @@
+"""
+Trigger-maintained trend rollups must always match a full rebuild
+
+    python -m unittest discover -s tests
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import INSERT_SCAN_SQL, ROLLUPS, Database
+
+
+class RollupTriggerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db = Database(os.path.join(self.tmp.name, 'smilo.db'))
+
+        # A scan every 7 hours over ten weeks
+        start = datetime(2026, 1, 1)
+        rows = []
+        for i in range(240):
+            when = start + timedelta(hours=7 * i)
+            rows.append((when.strftime("%Y-%m-%d %H:%M:%S"), i % 100, (i * 3) % 100,
+                         (i * 7) % 100, (i * 11) % 100, '{}', int(when.timestamp()), None))
+        with self.db.transaction() as cursor:
+            cursor.executemany(INSERT_SCAN_SQL, rows)
+
+    def tearDown(self):
+        self.db.close()
+        self.tmp.cleanup()
+
+    def rollups(self):
+        with self.db.connection() as conn:
+            return {table: conn.execute(f"SELECT * FROM {table} ORDER BY bucket").fetchall()
+                    for table, _, _ in ROLLUPS.values()}
+
+    def assert_matches_rebuild(self):
+        maintained = self.rollups()
+        self.db.rebuild_rollups()
+        self.assertEqual(maintained, self.rollups())
+
+    def test_insert(self):
+        self.assert_matches_rebuild()
+
+    def test_date_only_update(self):
+        # created_ts is left alone: the new bucket must still be recomputed
+        with self.db.transaction() as cursor:
+            cursor.execute("UPDATE scans SET date = '2026-03-03 10:00:00' WHERE id % 11 = 0")
+        self.assert_matches_rebuild()
+
+    def test_score_update_and_delete(self):
+        with self.db.transaction() as cursor:
+            cursor.execute("UPDATE scans SET overall_score = overall_score / 2 WHERE id % 7 = 0")
+            cursor.execute("DELETE FROM scans WHERE id % 5 = 0")
+        self.assert_matches_rebuild()
+
+
+if __name__ == "__main__":
+    unittest.main()
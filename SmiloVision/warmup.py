@@ -0,0 +1,142 @@
+"""
+Process warm-up for the Smilo server
+Runs a tiny synthetic scan through analysis, overlay and PDF report so the
+first real scan does not pay for lazy initialization
+"""
+
+import io
+import json
+import logging
+import threading
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+_ready = threading.Event()
+_start_lock = threading.Lock()
+_thread = None
+
+
+def synthetic_scan(width=320, height=240):
+    """
+    Small mouth-like test image that exercises every analysis stage
+
+    A row of off-white teeth with a yellow tint and a few dark spots on a
+    dark red background.
+    """
+    img = np.empty((height, width, 3), dtype=np.uint8)
+    img[:] = (90, 20, 30)
+
+    tooth_width = width // 8
+    top, bottom = height // 3, 2 * height // 3
+    for i in range(6):
+        x0 = width // 8 + i * tooth_width
+        color = (235, 230, 215) if i % 2 else (232, 222, 185)
+        cv2.rectangle(img, (x0, top), (x0 + tooth_width - 1, bottom), color, -1)
+
+    for i in range(3):
+        center = (width // 4 + i * width // 4, height // 2)
+        cv2.circle(img, center, 4, (70, 60, 50), -1)
+
+    return img
+
+
+def warm_up(analyzer=None, report_generator=None, include_charts=True):
+    """
+    Run one synthetic scan end to end and time each stage
+
+    Args:
+        analyzer: TeethAnalyzer to warm; a fresh uncached one by default
+        report_generator: ReportGenerator to warm; a fresh one by default
+        include_charts: Also build a plotly figure to load its templates
+
+    Returns:
+        dict of stage name to seconds, plus 'total'
+    """
+    timings = {}
+    start = time.perf_counter()
+
+    def lap(stage, stage_start):
+        timings[stage] = round(time.perf_counter() - stage_start, 4)
+
+    # Imports are part of what a cold process pays for
+    stage_start = time.perf_counter()
+    from image_analyzer import TeethAnalyzer
+    from report_generator import ReportGenerator
+    if analyzer is None:
+        analyzer = TeethAnalyzer()
+    if report_generator is None:
+        report_generator = ReportGenerator()
+    lap('imports', stage_start)
+
+    # Pixel class table, CLAHE and OpenCV kernels
+    img = synthetic_scan()
+    stage_start = time.perf_counter()
+    results = analyzer.analyze_teeth(img)
+    lap('analysis', stage_start)
+
+    stage_start = time.perf_counter()
+    analyzer.create_visual_overlay(img, results, output='png')
+    lap('overlay', stage_start)
+
+    # reportlab styles, fonts and image handling
+    stage_start = time.perf_counter()
+    image_file = io.BytesIO()
+    Image.fromarray(img).save(image_file, format='PNG')
+    report_generator.generate_pdf_report(image_file, results)
+    lap('report', stage_start)
+
+    if include_charts:
+        stage_start = time.perf_counter()
+        import plotly.graph_objects as go
+        go.Figure(go.Bar(x=['a', 'b'], y=[1, 2])).to_json()
+        lap('charts', stage_start)
+
+    timings['total'] = round(time.perf_counter() - start, 4)
+    return timings
+
+
+def _warm_up_services():
+    """Warm the shared services and log the stage timings"""
+    from services import get_analyzer, get_report_generator
+    try:
+        timings = warm_up(get_analyzer(), get_report_generator())
+        logger.info("Warm-up finished in %.2fs: %s", timings['total'], timings)
+    except Exception:
+        logger.exception("Warm-up failed; first scan will initialize lazily")
+    finally:
+        _ready.set()
+
+
+def start_warm_up():
+    """
+    Warm the shared services in a background thread, once per process
+
+    Returns immediately; later calls are no-ops. Use wait_ready() to block
+    until the warm-up has finished.
+    """
+    global _thread
+    with _start_lock:
+        if _thread is None:
+            _thread = threading.Thread(target=_warm_up_services,
+                                       name='smilo-warm-up', daemon=True)
+            _thread.start()
+
+
+def is_ready():
+    """True once the process warm-up has finished (or failed)"""
+    return _ready.is_set()
+
+
+def wait_ready(timeout=None):
+    """Block until the process warm-up has finished; False on timeout"""
+    return _ready.wait(timeout)
+
+
+if __name__ == "__main__":
+    # Prints cold-start timings, used to size the server's readiness probe
+    print(json.dumps(warm_up()))